@@ -1,9 +1,67 @@
-import argparse
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext
 import backtrader as bt
 import numpy as np
-from datetime import date, timedelta
+from index_engine import (align_market_data, constituent_returns, entry_steps, index_weights, run_index_engine,
+                          run_index_engine_horizons, traded_columns, weight_table)
+from market_data import window_market_data
+from datetime import date, datetime, time
 from pathlib import Path
-import sys
+from time import perf_counter, process_time
+
+# Rebalance trace (DEBUG) and per-run summaries (INFO); silent unless configured, see --log-level
+logger = logging.getLogger('analyze')
+
+# Opt-in backtrader analyzers (--analyzers): name -> (analyzer, output column, value read from get_analysis()).
+# Columns are named analyzer.key so quantify.py and visualize.py can tell them from assets.
+ANALYZERS = {
+    'returns': (bt.analyzers.Returns, 'returns.rnorm100', lambda analysis: analysis['rnorm100']),
+    'sharpe': (bt.analyzers.SharpeRatio, 'sharpe.sharperatio', lambda analysis: analysis['sharperatio']),
+    'drawdown': (bt.analyzers.DrawDown, 'drawdown.max', lambda analysis: analysis['max']['drawdown']),
+}
+
+class RunProfile:
+    """Wall and CPU seconds, call counts and event counts per stage, collected by --profile."""
+
+    def __init__(self):
+        self.wall = {}
+        self.cpu = {}
+        self.calls = {}
+        self.counts = {}
+
+    @contextmanager
+    def stage(self, name):
+        wall, cpu = perf_counter(), process_time()
+        try:
+            yield
+        finally:
+            self.wall[name] = self.wall.get(name, 0.0) + perf_counter() - wall
+            self.cpu[name] = self.cpu.get(name, 0.0) + process_time() - cpu
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def timed(self, name, func):
+        """Wrap func so every call is timed as stage name."""
+        def wrapper(*args, **kwargs):
+            with self.stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+
+    def count(self, name, n=1):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def add(self, other):
+        """Accumulate the stages and counts of another profile into this one."""
+        for mine, theirs in ((self.wall, other.wall), (self.cpu, other.cpu),
+                             (self.calls, other.calls), (self.counts, other.counts)):
+            for name, value in theirs.items():
+                mine[name] = mine.get(name, 0) + value
+
+    def as_dict(self):
+        return {'wall_seconds': self.wall, 'cpu_seconds': self.cpu, 'calls': self.calls, 'counts': self.counts}
 
 class CoinGeckoCSVData(bt.feeds.GenericCSVData):
     params = (
@@ -44,13 +102,155 @@ class CoinGeckoCSVData(bt.feeds.GenericCSVData):
                     print(f"Error reading file: {e}")
         return num_points
 
+# Fractional day of the default session end, matching GenericCSVData timestamps
+SESSION_END = bt.date2num(datetime.combine(date(1, 1, 1), time(23, 59, 59, 999990))) - 1.0
+# Ordinal of the numpy datetime64 epoch (1970-01-01)
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+class CoinGeckoArrayData(bt.feed.DataBase):
+    """Feed serving a coin's records from load_market_data() without re-parsing files."""
+    lines = ('marketcap',)
+
+    def start(self):
+        super(CoinGeckoArrayData, self).start()
+        records = self.p.dataname
+        ordinals = records['snapped_at'].astype('int64') + EPOCH_ORDINAL
+        self._datetime = (ordinals + SESSION_END).tolist()
+        self._price = records['price'].tolist()
+        self._marketcap = records['market_cap'].tolist()
+        self._volume = records['total_volume'].tolist()
+        self._idx = -1
+
+    def _load(self):
+        self._idx += 1
+        if self._idx >= len(self._datetime):
+            return False
+
+        price = self._price[self._idx]
+        self.lines.datetime[0] = self._datetime[self._idx]
+        self.lines.open[0] = price
+        self.lines.high[0] = price
+        self.lines.low[0] = price
+        self.lines.close[0] = price
+        self.lines.volume[0] = self._volume[self._idx]
+        self.lines.marketcap[0] = self._marketcap[self._idx]
+        return True
+
+class BatchRebalanceBroker(bt.BrokerBase):
+    """Broker that takes a whole target weight vector per rebalance instead of one order per asset.
+
+    Reproduces the market orders order_target_percent sends to the default
+    BackBroker as array updates: sizes are floored at the close, checked
+    against cash in asset order on the next bar, and filled at each asset's
+    next open, where buys that no longer fit in cash are dropped. Commission
+    is a fraction of the traded value and slippage a fraction of the fill
+    price, against the trade. It sends no order notifications, so it counts
+    orders, fills and rejections into profile itself.
+    """
+    params = (
+        ('cash', 1000000.0),
+        ('commission', 0.0),
+        ('slippage', 0.0),
+        ('profile', None),  # RunProfile counting orders like IndexComparisonStrategy.notify_order
+    )
+
+    def __init__(self):
+        super(BatchRebalanceBroker, self).__init__()
+        self.cash = self.startingcash = self.p.cash
+        self.datas = []
+        self.position = np.zeros(0)
+
+    def start(self):
+        super(BatchRebalanceBroker, self).start()
+        self.datas = self.cerebro.datas
+        n_assets = len(self.datas)
+        self.position = np.zeros(n_assets)
+        self.order_size = np.zeros(n_assets)   # signed, 0 when no order
+        self.order_price = np.zeros(n_assets)  # close at order creation
+        self.accepted = np.zeros(n_assets, dtype=bool)
+        self.bars = np.zeros(n_assets, dtype=np.int64)
+
+    def set_cash(self, cash):
+        self.cash = self.startingcash = self.p.cash = cash
+
+    def getcash(self):
+        return self.cash
+
+    def getvalue(self, datas=None):
+        if not self.position.any():
+            return self.cash
+        close = np.array([data.close[0] for data in self.datas])
+        # Add position values one by one like BackBroker so values match it exactly
+        return self.cash + sum((self.position * close).tolist())
+
+    def get_notification(self):
+        return None
+
+    def trade_cost(self, size, price):
+        """Cash paid for trades of size at price (negative for sales), commission included."""
+        value = size * price
+        return value + np.abs(value) * self.p.commission
+
+    def next(self):
+        bars = np.array([len(data) for data in self.datas], dtype=np.int64)
+        new_bar = bars != self.bars
+        self.bars = bars
+
+        # Margin check of last bar's orders in submission order, on a running cash balance
+        submitted = (self.order_size != 0) & ~self.accepted
+        if submitted.any():
+            running = self.cash - np.cumsum(np.where(submitted, self.trade_cost(self.order_size, self.order_price), 0.0))
+            self.accepted |= submitted & (running >= 0)
+            self.order_size[submitted & (running < 0)] = 0
+            self.count('rejected', int((submitted & (running < 0)).sum()))
+
+        # Fill accepted orders at the open of assets with a new bar
+        fills = self.accepted & new_bar
+        for i in np.flatnonzero(fills):
+            size = self.order_size[i]
+            price = self.datas[i].open[0] * (1 + self.p.slippage if size > 0 else 1 - self.p.slippage)
+            cost = self.trade_cost(size, price)
+            # Buys that no longer fit in cash are dropped, sales always fill
+            if size < 0 or self.cash - cost >= 0:
+                self.cash -= cost
+                self.position[i] += size
+                self.count('fills')
+            else:
+                self.count('rejected')
+        self.order_size[fills] = 0
+        self.accepted &= ~fills
+
+    def rebalance(self, weights):
+        """Replace pending orders with the trades that bring every asset to its weight (NaN: leave as is)."""
+        close = np.array([data.close[0] for data in self.datas])
+        value = self.getvalue()
+        trade = ~np.isnan(weights) & (close > 0)
+        price = np.where(trade, close, 1.0)
+        target = np.where(trade, weights, 0.0) * value
+        current = self.position * close
+        size = np.where(target > current, np.floor_divide(target - current, price), 0.0)
+        size = np.where(target < current, -np.floor_divide(current - target, price), size)
+        # A zero weight closes the whole position
+        size = np.where((weights == 0) & (self.position != 0), -self.position, size)
+        self.order_size = np.where(trade, size, 0.0)
+        self.order_price = close
+        self.accepted[:] = False
+        self.count('orders', int(np.count_nonzero(self.order_size)))
+
+    def count(self, name, n=1):
+        if self.p.profile is not None and n:
+            self.p.profile.count(name, n)
+
 class IndexComparisonStrategy(bt.Strategy):
     params = (
         ('rebalance_days', 30),
-        ('min_allocation', 0.01),
+        ('min_allocation', 0.0),
+        ('top', None),           # only hold the top assets by market cap at each rebalance
         ('start_date', None),
         ('end_date', None),
-        ('output_file', None),
+        ('weight_table', None),  # shared (dates, dates x assets weights) from index_engine.weight_table
+        ('horizons', None),      # end dates (up to end_date) to snapshot returns at, see horizon_results
+        ('profile', None),       # RunProfile timing next/rebalance/stop and counting orders
     )
     
     def __init__(self):
@@ -63,10 +263,31 @@ class IndexComparisonStrategy(bt.Strategy):
         if isinstance(self.p.end_date, str):
             self.end_date = date.fromisoformat(self.p.end_date)
         
-        # Track portfolio and individual asset values
-        self.portfolio_value = []
-        self.asset_values = {data._name: [] for data in self.assets}
-        self.dates = []
+        # Track portfolio and individual asset values (first self.steps rows), preallocated
+        # for every bar of the longest (preloaded) feed and grown if the feeds have gaps
+        capacity = max([data.buflen() for data in self.assets] + [1])
+        self.steps = 0
+        self.day_ordinals = np.empty(capacity, dtype=np.int64)
+        self.portfolio_value = np.empty(capacity)
+        self.asset_values = np.empty((capacity, len(self.assets)))
+        self.metrics = None
+        self.result = None
+        self.horizon_results = None
+
+        # Time the strategy's hooks (next includes rebalance)
+        if self.p.profile is not None:
+            self.next = self.p.profile.timed('next', self.next)
+            self.rebalance_portfolio = self.p.profile.timed('rebalance', self.rebalance_portfolio)
+            self.stop = self.p.profile.timed('stop', self.stop)
+
+    def notify_order(self, order):
+        if self.p.profile is not None:
+            if order.status == order.Submitted:
+                self.p.profile.count('orders')
+            elif order.status == order.Completed:
+                self.p.profile.count('fills')
+            elif order.status in (order.Margin, order.Rejected):
+                self.p.profile.count('rejected')
 
     def next(self):
         current_date = bt.num2date(self.data0.datetime[0]).date()
@@ -82,10 +303,14 @@ class IndexComparisonStrategy(bt.Strategy):
             self.rebalance_portfolio()
         
         # Record daily values for comparison
-        self.dates.append(current_date)
-        self.portfolio_value.append(self.broker.getvalue())
-        for data in self.assets:
-            self.asset_values[data._name].append(data.close[0])
+        if self.steps == len(self.portfolio_value):
+            self.day_ordinals = np.resize(self.day_ordinals, 2 * self.steps)
+            self.portfolio_value = np.resize(self.portfolio_value, 2 * self.steps)
+            self.asset_values = np.resize(self.asset_values, (2 * self.steps, len(self.assets)))
+        self.day_ordinals[self.steps] = current_date.toordinal()
+        self.portfolio_value[self.steps] = self.broker.getvalue()
+        self.asset_values[self.steps] = [data.close[0] for data in self.assets]
+        self.steps += 1
 
     def rebalance_portfolio(self):
         """Rebalance portfolio based on market cap weights."""
@@ -98,6 +323,30 @@ class IndexComparisonStrategy(bt.Strategy):
         if self.p.end_date and current_date > self.p.end_date:
             return
 
+        if self.p.weight_table is not None:
+            weights = self.lookup_weights()
+        else:
+            weights = self.compute_weights()
+        if not weights:
+            return
+
+        # Log rebalancing info
+        if logger.isEnabledFor(logging.DEBUG):
+            lines = [f"\nRebalanced portfolio on {current_date}:"]
+            lines += [f"  {name}: {weight:.2%}" for name, weight in weights.items()]
+            logger.debug("\n".join(lines))
+
+        # Execute trades to match target weights, in one batch if the broker takes them
+        if isinstance(self.broker, BatchRebalanceBroker):
+            self.broker.rebalance(np.array([weights.get(data._name, np.nan) for data in self.datas]))
+            return
+        for data in self.datas:
+            name = data._name
+            if name in weights and data.close[0] > 0:  # Only trade if price is non-zero
+                self.order_target_percent(data, target=weights[name])
+
+    def compute_weights(self):
+        """Calculate market cap weights of assets that exist on the current date."""
         # Get market caps for assets that exist on the current date
         market_caps = {}
         for data in self.datas:
@@ -107,82 +356,156 @@ class IndexComparisonStrategy(bt.Strategy):
                 market_caps[name] = data.lines.marketcap[0]
 
         if not market_caps:
-            return
+            return None
 
         # Calculate weights based on market cap
-        total_market_cap = sum(market_caps.values())
-        weights = {name: cap / total_market_cap for name, cap in market_caps.items()}
+        if self.p.top:
+            # Rank assets with a known market cap (sorted() keeps feed order on ties) and sell the rest
+            ranked = sorted((name for name, cap in market_caps.items() if cap == cap),
+                            key=lambda name: -market_caps[name])[:self.p.top]
+            if not ranked:
+                return None
+            total_market_cap = sum(cap for name, cap in market_caps.items() if name in ranked)
+            weights = {name: cap / total_market_cap if name in ranked else 0.0 for name, cap in market_caps.items()}
+        else:
+            total_market_cap = sum(market_caps.values())
+            weights = {name: cap / total_market_cap for name, cap in market_caps.items()}
 
-        # Print rebalancing info
-        print(f"\nRebalanced portfolio on {current_date}:")
-        for name, weight in weights.items():
-            print(f"  {name}: {weight:.2%}")
+        # Drop assets below the minimum allocation and scale the others back up
+        if self.p.min_allocation:
+            kept = {name: weight for name, weight in weights.items() if weight >= self.p.min_allocation}
+            if not kept:
+                return None
+            kept_total = sum(kept.values())
+            weights = {name: kept[name] / kept_total if name in kept else 0.0 for name in weights}
+        return weights
 
-        # Execute trades to match target weights
-        for data in self.datas:
-            name = data._name
-            if name in weights and data.close[0] > 0:  # Only trade if price is non-zero
-                self.order_target_percent(data, target=weights[name])
+    def lookup_weights(self):
+        """Read the current date's weights from the shared weight_table (see index_engine.weight_table)."""
+        dates, table = self.p.weight_table
+        # The newest bar among the feeds is the clock's date, even if data0 has a gap
+        current_date = np.datetime64(bt.num2date(max(data.datetime[0] for data in self.datas)).date(), 'D')
+        row = np.searchsorted(dates, current_date)
+        if row == len(dates) or dates[row] != current_date:
+            return self.compute_weights()
+        # NaN marks assets without a price, or a date with nothing to rebalance
+        return {data._name: weight for data, weight in zip(self.datas, table[row].tolist()) if weight == weight}
 
     def stop(self):
-        """Calculate and print performance metrics."""
-        print("\n=== Performance Comparison ===")
-        
+        """Calculate performance metrics into self.metrics and self.result, and log them."""
+        # No bars in range (e.g. an entry date after the data ends): no result, like the NumPy engine
+        if self.steps == 0:
+            return
+        portfolio_value = self.portfolio_value[:self.steps]
+        asset_values = self.asset_values[:self.steps]
+
         # Calculate index performance
-        index_returns = np.diff(self.portfolio_value) / self.portfolio_value[:-1]
-        total_return = (self.portfolio_value[-1] - self.portfolio_value[0]) / self.portfolio_value[0] * 100
+        index_returns = np.diff(portfolio_value) / portfolio_value[:-1]
+        total_return = (portfolio_value[-1] - portfolio_value[0]) / portfolio_value[0] * 100
         sharpe = np.sqrt(365) * index_returns.mean() / index_returns.std() if index_returns.std() > 0 else 0
-        max_drawdown = (np.maximum.accumulate(self.portfolio_value) - self.portfolio_value).max() / np.maximum.accumulate(self.portfolio_value).max() * 100
-        
-        # Calculate constituents performance
+        max_drawdown = (np.maximum.accumulate(portfolio_value) - portfolio_value).max() / np.maximum.accumulate(portfolio_value).max() * 100
+
+        # Calculate constituents performance over their non-zero values, all assets at once
+        held = asset_values > 0
+        counts = held.sum(axis=0)
+        steps = np.arange(self.steps)[:, None]
+        # Previous non-zero value of every step, to get returns between consecutive non-zero values
+        previous = np.maximum.accumulate(np.where(held, steps, -1), axis=0)
+        previous = np.vstack([np.full((1, held.shape[1]), -1), previous[:-1]])
+        stepped = held & (previous >= 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            previous_value = np.take_along_axis(asset_values, np.maximum(previous, 0), axis=0)
+            returns = np.where(stepped, (asset_values - previous_value) / previous_value, 0.0)
+            n_returns = stepped.sum(axis=0)
+            mean = returns.sum(axis=0) / n_returns
+            std = np.sqrt(np.where(stepped, (returns - mean) ** 2, 0.0).sum(axis=0) / n_returns)
+            sharpe_assets = np.where(std > 0, np.sqrt(365) * mean / std, 0)
+
+            # Max drawdown against the running maximum of non-zero values
+            peaks = np.maximum.accumulate(np.where(held, asset_values, -np.inf), axis=0)
+            drawdowns = np.where(held, peaks - asset_values, -np.inf).max(axis=0) / peaks[-1] * 100
+
+        initial_price, final_price = self.first_last_nonzero(asset_values)
         constituent_perf = {}
-        for name, values in self.asset_values.items():
-            # Skip assets that don't have any non-zero values
-            if all(v == 0 for v in values):
-                continue
-                
-            # Find first non-zero value as initial price
-            initial_price = next((v for v in values if v > 0), None)
-            if initial_price is None:
-                continue
-                
-            # Calculate returns only for non-zero values
-            non_zero_values = [v for v in values if v > 0]
-            if len(non_zero_values) < 2:
-                continue
-                
-            final_price = non_zero_values[-1]
-            total_return_asset = (final_price - initial_price) / initial_price * 100
-            
-            # Calculate returns array for Sharpe ratio
-            returns = np.diff(non_zero_values) / non_zero_values[:-1]
-            sharpe_asset = np.sqrt(365) * returns.mean() / returns.std() if returns.std() > 0 else 0
-            
-            # Calculate max drawdown
-            max_drawdown_asset = (np.maximum.accumulate(non_zero_values) - non_zero_values).max() / np.maximum.accumulate(non_zero_values).max() * 100
-            
-            constituent_perf[name] = {
-                'return': total_return_asset,
-                'sharpe': sharpe_asset,
-                'drawdown': max_drawdown_asset
+        for i in np.flatnonzero(counts >= 2):
+            constituent_perf[self.assets[i]._name] = {
+                'return': (final_price[i] - initial_price[i]) / initial_price[i] * 100,
+                'sharpe': sharpe_assets[i],
+                'drawdown': drawdowns[i]
             }
-        
-        # Print comparison table
-        print(f"{'Asset':<10} {'Return %':>10} {'Sharpe':>10} {'Max DD %':>10}")
-        print(f"{'Index':<10} {total_return:>10.2f} {sharpe:>10.2f} {max_drawdown:>10.2f}")
+
+        # Keep all metrics as a record keyed by asset ('index' first)
+        self.metrics = {'index': {'return': total_return, 'sharpe': sharpe, 'drawdown': max_drawdown}}
+        self.metrics.update(constituent_perf)
+
+        # Log comparison table
+        if logger.isEnabledFor(logging.INFO):
+            lines = ["\n=== Performance Comparison ===", f"{'Asset':<10} {'Return %':>10} {'Sharpe':>10} {'Max DD %':>10}"]
+            for name, perf in self.metrics.items():
+                label = 'Index' if name == 'index' else name
+                lines.append(f"{label:<10} {perf['return']:>10.2f} {perf['sharpe']:>10.2f} {perf['drawdown']:>10.2f}")
+            logger.info("\n".join(lines))
+
+        # Keep results as a returns.csv row (market entry, index, then constituents)
+        self.result = {'market_entry': self.p.start_date, 'index': total_return}
         for name, perf in constituent_perf.items():
-            print(f"{name:<10} {perf['return']:>10.2f} {perf['sharpe']:>10.2f} {perf['drawdown']:>10.2f}")
+            self.result[name] = perf['return']
 
-        # Write results to output file
-        if self.p.output_file:
-            values = [self.p.start_date.isoformat()] + [f"{total_return:.2f}"] + [f"{perf['return']:.2f}" for perf in constituent_perf.values()]
-            print(",".join(values), file=self.p.output_file)
+        # Returns a run ending at each horizon would have reported, from the recorded prefix up to it
+        if self.p.horizons:
+            self.horizon_results = {}
+            ordinals = self.day_ordinals[:self.steps]
+            for horizon in self.p.horizons:
+                steps = np.searchsorted(ordinals, horizon.toordinal(), side='right')
+                if steps:
+                    self.horizon_results[horizon] = self.prefix_result(steps)
 
-def run_strategy(data_files, start_date=None, end_date=None, output_file=None):
-    """Run strategy and write output to file handle or stdout."""
-    
-    # Determine output destination
-    output_dest = output_file if output_file else sys.stdout
+    def first_last_nonzero(self, asset_values):
+        """First and last non-zero value of every asset column (meaningless for columns without one)."""
+        held = asset_values > 0
+        first = held.argmax(axis=0)
+        last = len(held) - 1 - held[::-1].argmax(axis=0)
+        columns = np.arange(held.shape[1])
+        return asset_values[first, columns], asset_values[last, columns]
+
+    def prefix_result(self, steps):
+        """Result row (as self.result) of the first steps recorded days."""
+        values = self.portfolio_value[:steps]
+        result = {'market_entry': self.p.start_date, 'index': (values[-1] - values[0]) / values[0] * 100}
+        asset_values = self.asset_values[:steps]
+        initial_price, final_price = self.first_last_nonzero(asset_values)
+        for i in np.flatnonzero((asset_values > 0).sum(axis=0) >= 2):
+            result[self.assets[i]._name] = (final_price[i] - initial_price[i]) / initial_price[i] * 100
+        return result
+
+def format_result(result, columns=None):
+    """Format a strategy result as a returns.csv line (without newline).
+
+    With columns (the header after market_entry), values are placed under their
+    column and missing ones are left empty.
+    """
+    if columns is None:
+        columns = [key for key in result if key != 'market_entry']
+    values = [result['market_entry'].isoformat()]
+    values += ["" if result.get(key) is None else f"{result[key]:.2f}" for key in columns]
+    return ",".join(values)
+
+def run_strategy(data_files, start_date=None, end_date=None, output_file=None, market_data=None,
+                 rebalance_days=30, min_allocation=0.0, weight_table=None, analyzers=(), horizons=None,
+                 profile=None, broker='backtrader', commission=0.0, slippage=0.0, top=None):
+    """Run strategy and return its result row, also writing it to output_file if given.
+
+    When market_data (from load_market_data) is given, feeds are served from it
+    instead of parsing data_files again. A weight_table built for the same
+    data_files, min_allocation and top turns rebalancing into a lookup. top
+    only holds the top assets by market cap at each rebalance. analyzers
+    names ANALYZERS to attach; their values are added to the result under
+    their column. With horizons (end dates up to end_date), returns
+    {horizon: result} snapshots of the single run instead. A RunProfile
+    passed as profile collects stage timings of the run. broker 'batch' uses
+    BatchRebalanceBroker (with commission and slippage) instead of backtrader's
+    broker (with commission only).
+    """
 
     cerebro = bt.Cerebro()
     
@@ -197,11 +520,30 @@ def run_strategy(data_files, start_date=None, end_date=None, output_file=None):
         IndexComparisonStrategy,
         start_date=start_date,
         end_date=end_date,
-        output_file=output_dest 
+        rebalance_days=rebalance_days,
+        min_allocation=min_allocation,
+        top=top,
+        weight_table=weight_table,
+        horizons=horizons,
+        profile=profile
     )
     
+    # Only feed the bars between the entry date and the end date
+    if market_data is not None:
+        market_data = window_market_data(market_data, [file.stem for file in data_files], start_date, end_date)
+
     # Load constituent data files
     for file in data_files:
+        if market_data is not None:
+            data = CoinGeckoArrayData(
+                dataname=market_data[file.stem],
+                timeframe=bt.TimeFrame.Days,
+                compression=1
+            )
+            data._name = file.stem
+            cerebro.adddata(data)
+            continue
+
         try:
             # Check if file exists
             if not file.exists():
@@ -218,79 +560,290 @@ def run_strategy(data_files, start_date=None, end_date=None, output_file=None):
             print(f"Failed to load {file}: {str(e)}")
             return
     
-    # Set initial capital
+    # Set broker and initial capital
+    if broker == 'batch':
+        cerebro.broker = BatchRebalanceBroker(commission=commission, slippage=slippage, profile=profile)
+    elif commission:
+        cerebro.broker.setcommission(commission=commission)
     cerebro.broker.set_cash(1000000)
     
-    # Add analyzers
-    cerebro.addanalyzer(bt.analyzers.Returns, _name='returns')
-    cerebro.addanalyzer(bt.analyzers.SharpeRatio, _name='sharpe')
-    cerebro.addanalyzer(bt.analyzers.DrawDown, _name='drawdown')
+    # Add requested analyzers only, each one costs a callback per bar
+    for name in analyzers:
+        cerebro.addanalyzer(ANALYZERS[name][0], _name=name)
     
+    # Time feed loading and broker order handling inside the run
+    if profile is not None:
+        for data in cerebro.datas:
+            data.preload = profile.timed('preload', data.preload)
+        cerebro.broker.next = profile.timed('broker', cerebro.broker.next)
+
     # Run backtest
-    print('\nStarting Portfolio Value: %.2f' % cerebro.broker.getvalue())
-    results = cerebro.run()
-    print('Final Portfolio Value: %.2f' % cerebro.broker.getvalue())
+    logger.info('\nStarting Portfolio Value: %.2f', cerebro.broker.getvalue())
+    with profile.stage('run') if profile is not None else nullcontext():
+        results = cerebro.run()
+    logger.info('Final Portfolio Value: %.2f', cerebro.broker.getvalue())
 
-def valid_date(date_string):
-    """Validate date format YYYY-MM-DD"""
-    try:
-        return date.fromisoformat(date_string)
-    except ValueError:
-        raise argparse.ArgumentTypeError(f"Invalid date: '{date_string}'. Expected format: YYYY-MM-DD")
+    strategy = results[0]
+    if horizons:
+        return strategy.horizon_results
+    result = strategy.result
+    if result:
+        for name in analyzers:
+            _, column, value = ANALYZERS[name]
+            result[column] = value(getattr(strategy.analyzers, name).get_analysis())
+    if output_file and result:
+        print(format_result(result), file=output_file)
+    return result
 
-if __name__ == '__main__':
-    DEFAULT_START_INTERVAL0 = valid_date("2018-01-01")
-    DEFAULT_START_INTERVAL1 = valid_date("2018-12-31")
-    DEFAULT_END = valid_date("2024-12-31")
-    DEFAULT_OUTPUT = "returns.csv"
-
-    parser = argparse.ArgumentParser(description='Cryptocurrency analysis tool')
-    parser.add_argument('--cryptos', nargs='+', default=['bitcoin', 'ethereum', 'cardano'],
-                       help='List of cryptocurrencies to analyze (space-separated)')
-    parser.add_argument('--start-interval', nargs=2, type=valid_date,
-                   default=[DEFAULT_START_INTERVAL0, DEFAULT_START_INTERVAL1],
-                   metavar=('START', 'END'),
-                   help=f'Date range (default: {DEFAULT_START_INTERVAL0} to {DEFAULT_START_INTERVAL1})')
-    parser.add_argument('--end-date', type=valid_date,
-                      default=DEFAULT_END,
-                      metavar='DATE',
-                      help=f'Single end date (default: {DEFAULT_END})')
-    parser.add_argument('--output', type=str,
-                      default=DEFAULT_OUTPUT,
-                      metavar='FILENAME',
-                      help=f'Output filename (default: {DEFAULT_OUTPUT})')
-    args = parser.parse_args()
-
-    # Validate date ordering
-    if args.start_interval and args.start_interval[0] > args.start_interval[1]:
-        parser.error("Start date must be before end date")
-    if args.start_interval[1] >= args.end_date:
-            parser.error(f"start-interval end date ({args.start_interval[1]}) must be before --end-date ({args.end_date})")
-
-    print(f"Analyzing cryptocurrencies: {args.cryptos}")
-
-    data_dir = Path('data/normalized')
-    data_files = [(data_dir / name).with_suffix('.csv') for name in args.cryptos]
-
-    # Verify data directory exists
-    if not data_dir.exists():
-        print(f"\nERROR: Normalized data directory '{data_dir}' not found")
-        print("Please run normalize_data.py first to create normalized data files")
-        exit(1)
-    
-    # Generate dates between start and end of interval
-    dates = []
-    current_date = args.start_interval[0]
-    while current_date <= args.start_interval[1]:
-        dates.append(current_date)
-        current_date += timedelta(days=1)
-    
-    with open(args.output, 'w') as f:
-        # Write header
-        header = f"market_entry,index,{','.join(args.cryptos)}\n"
+# Per-process state of the --jobs worker pool, set once by _init_worker
+_worker_args = None
+
+def profiled_run(data_files, start_date, end_date, market_data, strategy_params):
+    """Run one entry date and return (result, RunProfile of the run)."""
+    profile = RunProfile()
+    with profile.stage('entry'):
+        result = run_strategy(data_files, start_date, end_date, market_data=market_data, profile=profile,
+                              **strategy_params)
+    return result, profile
+
+def _init_worker(data_files, end_date, market_data, strategy_params, profiled):
+    global _worker_args
+    _worker_args = (data_files, end_date, market_data, strategy_params, profiled)
+
+def _run_entry(start_date):
+    data_files, end_date, market_data, strategy_params, profiled = _worker_args
+    if profiled:
+        return profiled_run(data_files, start_date, end_date, market_data, strategy_params)
+    return run_strategy(data_files, start_date, end_date, market_data=market_data, **strategy_params)
+
+def run_entries(data_files, dates, end_date, market_data, jobs=1, rebalance_days=30, min_allocation=0.0,
+                weight_table=None, analyzers=(), horizons=None, profiles=None, broker='backtrader',
+                commission=0.0, slippage=0.0, top=None):
+    """Yield the result of each market entry date in date order, using jobs processes.
+
+    With a profiles list, every run is profiled and (entry date, RunProfile)
+    is appended to it.
+    """
+    strategy_params = {'rebalance_days': rebalance_days, 'min_allocation': min_allocation,
+                       'weight_table': weight_table, 'analyzers': analyzers, 'horizons': horizons,
+                       'broker': broker, 'commission': commission, 'slippage': slippage, 'top': top}
+    profiled = profiles is not None
+    if jobs <= 1:
+        for start_date in dates:
+            if not profiled:
+                yield run_strategy(data_files, start_date, end_date, market_data=market_data, **strategy_params)
+                continue
+            result, profile = profiled_run(data_files, start_date, end_date, market_data, strategy_params)
+            profiles.append((start_date, profile))
+            yield result
+        return
+
+    # Entry dates cost about the same, so hand them out in a few even chunks per worker
+    chunksize = max(1, len(dates) // (jobs * 4))
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                             initargs=(data_files, end_date, market_data, strategy_params, profiled)) as executor:
+        for start_date, value in zip(dates, executor.map(_run_entry, dates, chunksize=chunksize)):
+            if profiled:
+                result, profile = value
+                profiles.append((start_date, profile))
+                yield result
+            else:
+                yield value
+
+def top_universe(data_files, aligned, min_allocation, top, dates, end_date):
+    """Return (feeds, weight table, left-out columns) of top runs from dates to end_date.
+
+    Coins that never make the top during the runs are not fed to backtrader
+    (see index_engine.traded_columns); add_left_out_returns fills in their returns.
+    """
+    columns = traded_columns(aligned, index_weights(aligned, min_allocation, top), dates, end_date)
+    left_out = np.setdiff1d(np.arange(len(data_files)), columns)
+    return ([data_files[i] for i in columns], weight_table(aligned, min_allocation, top, columns), left_out)
+
+def add_left_out_returns(results, aligned, left_out, dates, end_date):
+    """Yield results with the returns of the left_out coins added, keys in aligned coin order."""
+    names = aligned['names']
+    order = {name: i for i, name in enumerate(['market_entry', 'index'] + names)}
+    entries = {start_date: e for e, start_date in enumerate(dates)}
+    coin_returns = constituent_returns(aligned, *entry_steps(aligned, dates, end_date))
+    for result in results:
+        if result:
+            returns = coin_returns[entries[result['market_entry']]]
+            result.update((names[i], returns[i]) for i in left_out if returns[i] == returns[i])
+            result = dict(sorted(result.items(), key=lambda item: order.get(item[0], len(order))))
+        yield result
+
+def run_backtests(data_files, dates, end_date, market_data, engine='backtrader', jobs=1,
+                  rebalance_days=30, min_allocation=0.0, aligned=None, analyzers=(), profiles=None,
+                  broker='backtrader', commission=0.0, slippage=0.0, top=None):
+    """Return the results of all market entry dates in date order with the chosen engine.
+
+    aligned (from index_engine.align_market_data) lets calls share aligned arrays
+    and their market-cap weights, which both engines read instead of recomputing.
+    top only holds the top coins by market cap at each rebalance. analyzers
+    (see ANALYZERS), per-run profiles (see run_entries) and the broker
+    settings (see run_strategy) are only supported by the backtrader engine.
+    """
+    names = [file.stem for file in data_files]
+    if aligned is None:
+        aligned = align_market_data(market_data, names)
+    if engine == 'numpy':
+        if analyzers:
+            raise ValueError("analyzers require the backtrader engine")
+        return run_index_engine(market_data, names, dates, end_date, rebalance_days, min_allocation, aligned=aligned,
+                                top=top)
+    if not top:
+        return run_entries(data_files, dates, end_date, market_data, jobs, rebalance_days, min_allocation,
+                           weight_table(aligned, min_allocation), analyzers, profiles=profiles,
+                           broker=broker, commission=commission, slippage=slippage)
+    feeds, table, left_out = top_universe(data_files, aligned, min_allocation, top, dates, end_date)
+    results = run_entries(feeds, dates, end_date, market_data, jobs, rebalance_days, min_allocation, table,
+                          analyzers, profiles=profiles, broker=broker, commission=commission, slippage=slippage,
+                          top=top)
+    return add_left_out_returns(results, aligned, left_out, dates, end_date)
+
+def run_horizons(data_files, dates, end_dates, market_data, engine='backtrader', jobs=1,
+                 rebalance_days=30, min_allocation=0.0, aligned=None, profiles=None,
+                 broker='backtrader', commission=0.0, slippage=0.0, top=None):
+    """Return {end_date: results} for several end dates, simulating each entry date once.
+
+    Each run goes to the latest end date and snapshots the returns at the
+    earlier ones; the results equal run_backtests with each end date.
+    """
+    names = [file.stem for file in data_files]
+    if aligned is None:
+        aligned = align_market_data(market_data, names)
+    if engine == 'numpy':
+        return run_index_engine_horizons(market_data, names, dates, end_dates, rebalance_days, min_allocation,
+                                         aligned=aligned, top=top)
+    feeds, table, left_out = data_files, weight_table(aligned, min_allocation), []
+    if top:
+        feeds, table, left_out = top_universe(data_files, aligned, min_allocation, top, dates, max(end_dates))
+    results = {end_date: [] for end_date in end_dates}
+    for horizon_results in run_entries(feeds, dates, max(end_dates), market_data, jobs, rebalance_days,
+                                       min_allocation, table, horizons=sorted(set(end_dates)), profiles=profiles,
+                                       broker=broker, commission=commission, slippage=slippage, top=top):
+        for end_date, result in (horizon_results or {}).items():
+            results[end_date].append(result)
+    if len(left_out):
+        results = {end_date: list(add_left_out_returns(results[end_date], aligned, left_out, dates, end_date))
+                   for end_date in end_dates}
+    return results
+
+def format_horizon_rows(results, end_dates):
+    """Format {end_date: results} as long-format market_entry,market_exit,asset,return lines."""
+    rows = []
+    for end_date in sorted(set(end_dates)):
+        exit_date = end_date.isoformat()
+        for result in results[end_date]:
+            entry = result['market_entry'].isoformat()
+            rows += [(entry, exit_date, f"{entry},{exit_date},{asset},{value:.2f}\n")
+                     for asset, value in result.items() if asset != 'market_entry']
+    # Entry date, then exit date; assets keep their column order
+    rows.sort(key=lambda row: row[:2])
+    return [row[2] for row in rows]
+
+def print_profile(profile, entry_profiles):
+    """Print the --profile summary: pipeline stages, then per-run stages summed over entry dates."""
+    print("\n=== Profile ===")
+    print(f"{'Stage':<24} {'Wall s':>10} {'CPU s':>10}")
+    for name in profile.wall:
+        print(f"{name:<24} {profile.wall[name]:>10.3f} {profile.cpu[name]:>10.3f}")
+    if not entry_profiles:
+        return
+
+    total = RunProfile()
+    for _, entry_profile in entry_profiles:
+        total.add(entry_profile)
+    # Whatever the run spends outside the timed hooks: feed synchronization, clock, observers
+    inside = sum(total.wall.get(name, 0.0) for name in ('preload', 'next', 'broker', 'stop'))
+    inside_cpu = sum(total.cpu.get(name, 0.0) for name in ('preload', 'next', 'broker', 'stop'))
+    rows = [('entry', 'entry'), ('  setup and results', None), ('  run', 'run'), ('    preload', 'preload'),
+            ('    next', 'next'), ('      rebalance', 'rebalance'), ('    broker', 'broker'), ('    stop', 'stop'),
+            ('    other', None)]
+    print(f"\nbacktrader runs, summed over {len(entry_profiles)} entry dates:")
+    print(f"{'Stage':<24} {'Wall s':>10} {'CPU s':>10} {'Calls':>10}")
+    for label, name in rows:
+        if name is not None:
+            wall, cpu, calls = total.wall.get(name, 0.0), total.cpu.get(name, 0.0), total.calls.get(name, 0)
+        elif label.strip() == 'other':
+            wall, cpu, calls = total.wall.get('run', 0.0) - inside, total.cpu.get('run', 0.0) - inside_cpu, 0
+        else:
+            wall = total.wall.get('entry', 0.0) - total.wall.get('run', 0.0)
+            cpu, calls = total.cpu.get('entry', 0.0) - total.cpu.get('run', 0.0), 0
+        print(f"{label:<24} {wall:>10.3f} {cpu:>10.3f} {calls or '':>10}")
+    print(f"Bars: {total.calls.get('next', 0)}, orders: {total.counts.get('orders', 0)} "
+          f"(filled {total.counts.get('fills', 0)}, rejected {total.counts.get('rejected', 0)})")
+
+    print("\nSlowest entry dates:")
+    for start_date, entry_profile in sorted(entry_profiles, key=lambda item: -item[1].wall['entry'])[:5]:
+        print(f"  {start_date}: {entry_profile.wall['entry']:.3f} s, {entry_profile.calls.get('next', 0)} bars, "
+              f"{entry_profile.counts.get('orders', 0)} orders")
+
+def write_profile(output, profile, entry_profiles):
+    """Write pipeline stages and every entry date's RunProfile as JSON."""
+    with open(output, 'w') as f:
+        json.dump({
+            'stages': profile.as_dict(),
+            'entries': [{'market_entry': start_date.isoformat(), **entry_profile.as_dict()}
+                        for start_date, entry_profile in entry_profiles],
+        }, f, indent=2)
+
+def results_key(data_files, end_date, rebalance_days, min_allocation, analyzers=(), broker='backtrader',
+                commission=0.0, slippage=0.0, top=None):
+    """Describe everything a returns.csv row depends on besides its market entry date."""
+    return {
+        'broker': broker,
+        'commission': commission,
+        'slippage': slippage,
+        'end_date': end_date.isoformat(),
+        'cryptos': [file.stem for file in data_files],
+        'rebalance_days': rebalance_days,
+        'min_allocation': min_allocation,
+        'top': top,
+        'analyzers': list(analyzers),
+        'files': {file.stem: hashlib.sha256(file.read_bytes()).hexdigest() for file in data_files},
+    }
+
+def file_digest(path):
+    return hashlib.sha256(Path(path).read_bytes()).hexdigest()
+
+def read_cached_rows(output, key):
+    """Return existing output lines keyed by market entry date if they were computed with key.
+
+    The sidecar <output>.meta.json records the key together with a digest of
+    output, so rows written or edited by anything else are never reused.
+    """
+    meta_file = Path(f"{output}.meta.json")
+    if not meta_file.exists() or not Path(output).exists():
+        return {}
+    with open(meta_file) as f:
+        meta = json.load(f)
+    if meta.get('key') != key or meta.get('sha256') != file_digest(output):
+        print(f"Parameters, input files or {output} changed since its rows were computed, recomputing all rows")
+        return {}
+    with open(output) as f:
+        next(f)  # header
+        return {line.split(',', 1)[0]: line.rstrip('\n') for line in f}
+
+def write_cached_rows(output, header, rows, key):
+    """Replace output with header and rows in date order, and record the key they were computed with.
+
+    Both files are replaced atomically, so an interrupted run leaves the last
+    complete checkpoint for the next --incremental run to continue from.
+    """
+    with open(f"{output}.tmp", 'w') as f:
         f.write(header)
-        
-        # Run strategy for each date
-        for date in dates:
-            run_strategy(data_files, date, args.end_date, f)
+        f.writelines(rows[entry] + "\n" for entry in sorted(rows))
+    os.replace(f"{output}.tmp", output)
+    with open(f"{output}.meta.json.tmp", 'w') as f:
+        json.dump({'key': key, 'sha256': file_digest(output)}, f, indent=2)
+    os.replace(f"{output}.meta.json.tmp", f"{output}.meta.json")
+
+def clear_cached_rows(output):
+    """Forget the key of output before it is rewritten by a run that does not record one."""
+    Path(f"{output}.meta.json").unlink(missing_ok=True)
 
+if __name__ == '__main__':
+    from pipeline import run_script
+    run_script('analyze')
@@ -0,0 +1,227 @@
+import argparse
+import contextlib
+import io
+import json
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+import backtrader as bt
+import matplotlib
+import numpy as np
+import pandas as pd
+
+matplotlib.use('Agg')  # render heatmaps off-screen
+
+from analyze import CoinGeckoCSVData, format_result, run_backtests, run_strategy
+from market_data import load_market_data
+from normalize_data import normalize_data
+from pipeline import valid_date
+from quantify import compute_statistics
+from visualize import plot_heatmap
+
+SHIPPED_CRYPTOS = ['btc', 'eth', 'bch', 'xrp', 'ltc', 'ada', 'iota', 'dash', 'xem', 'xmr']
+# Subcommands whose cold start (interpreter, imports, argument parsing) the startup dataset times
+STARTUP_COMMANDS = [[], ['normalize'], ['analyze'], ['quantify'], ['plot']]
+
+def generate_synthetic(raw_dir, n_coins, years, end_date=date(2024, 12, 31), seed=0):
+    """Write n_coins CoinGecko-shaped raw CSVs covering years up to end_date and return the first date.
+
+    Prices follow geometric random walks. A third of the coins are listed
+    partway through the first half of the period, so normalization has to
+    pad them, and every file misses a few random days like the real exports.
+    """
+    rng = np.random.default_rng(seed)
+    raw_dir.mkdir(parents=True, exist_ok=True)
+    n_days = int(years * 365)
+    start_date = end_date - timedelta(days=n_days - 1)
+    days = np.arange(np.datetime64(start_date), np.datetime64(end_date) + 1)
+
+    for i in range(n_coins):
+        listed = int(rng.integers(1, n_days // 2)) if i % 3 == 2 else 0
+        kept = np.ones(n_days, dtype=bool)
+        kept[rng.integers(listed + 1, n_days, size=max(1, n_days // 500))] = False
+        steps = rng.normal(0.0005, 0.04, n_days)
+        price = rng.uniform(0.01, 1000) * np.exp(np.cumsum(steps))
+        market_cap = price * rng.uniform(1e6, 1e9) * (1 + rng.normal(0, 0.001, n_days))
+        total_volume = market_cap * rng.uniform(0.01, 0.2, n_days)
+
+        with open(raw_dir / f"syn{i:03d}.csv", 'w') as f:
+            f.write("snapped_at,price,market_cap,total_volume\n")
+            f.writelines(f"{day} 00:00:00 UTC,{p!r},{m!r},{v!r}\n"
+                         for day, p, m, v in zip(days[listed:][kept[listed:]].astype(str),
+                                                 price[listed:][kept[listed:]].tolist(),
+                                                 market_cap[listed:][kept[listed:]].tolist(),
+                                                 total_volume[listed:][kept[listed:]].tolist()))
+    return start_date
+
+def timed(func, *args, **kwargs):
+    """Call func and return (its value, wall seconds, CPU seconds of this process)."""
+    wall, cpu = time.perf_counter(), time.process_time()
+    value = func(*args, **kwargs)
+    return value, time.perf_counter() - wall, time.process_time() - cpu
+
+def load_csv_feeds(data_files):
+    """Preload every file through CoinGeckoCSVData, as a backtrader run parsing CSVs does."""
+    cerebro = bt.Cerebro()
+    for file in data_files:
+        data = CoinGeckoCSVData(dataname=str(file.absolute()), timeframe=bt.TimeFrame.Days, compression=1)
+        data.setenvironment(cerebro)
+        data._start()
+        data.preload()
+
+def write_returns(results, cryptos, output_file):
+    """Write backtest results as a returns.csv file for the quantify and heatmap stages."""
+    columns = ['index'] + cryptos
+    with open(output_file, 'w') as f:
+        f.write(f"market_entry,{','.join(columns)}\n")
+        f.writelines(format_result(result, columns) + "\n" for result in results if result)
+
+def benchmark_startup(repeat):
+    """Time pipeline.py --help of every subcommand in a fresh interpreter and return one record per run."""
+    records = []
+    pipeline = Path(__file__).with_name('pipeline.py')
+    for _ in range(repeat):
+        for command in STARTUP_COMMANDS:
+            before = resource.getrusage(resource.RUSAGE_CHILDREN)
+            wall = time.perf_counter()
+            subprocess.run([sys.executable, str(pipeline), *command, '--help'], stdout=subprocess.DEVNULL, check=True)
+            wall = time.perf_counter() - wall
+            after = resource.getrusage(resource.RUSAGE_CHILDREN)
+            cpu = after.ru_utime + after.ru_stime - before.ru_utime - before.ru_stime
+            stage = f"start {command[0] if command else 'pipeline'}"
+            records.append({'dataset': 'startup', 'coins': None, 'entries': None, 'stage': stage,
+                            'engine': None, 'jobs': 1, 'wall_seconds': wall, 'cpu_seconds': cpu})
+            print(f"{'startup':<10} {stage:<18} {'':<11} {1:>4} {wall:>10.3f} {cpu:>10.3f}")
+    return records
+
+def benchmark_dataset(name, raw_dir, cryptos, data_start, entry_start, end_date, work_dir,
+                      entries, engines, jobs_list, repeat):
+    """Time every pipeline stage on one dataset and return one record per stage and setting."""
+    records = []
+    normalized_dir = work_dir / name / 'normalized'
+    normalized_dir.mkdir(parents=True, exist_ok=True)
+    data_files = [(normalized_dir / crypto).with_suffix('.csv') for crypto in cryptos]
+    dates = [entry_start + timedelta(days=i) for i in range(entries)]
+
+    def record(stage, wall, cpu, **settings):
+        records.append({'dataset': name, 'coins': len(cryptos), 'entries': entries, 'stage': stage,
+                        'engine': settings.get('engine'), 'jobs': settings.get('jobs', 1),
+                        'wall_seconds': wall, 'cpu_seconds': cpu})
+        print(f"{name:<10} {stage:<18} {settings.get('engine') or '':<11} {settings.get('jobs', 1):>4} {wall:>10.3f} {cpu:>10.3f}")
+
+    for _ in range(repeat):
+        for jobs in jobs_list:
+            with contextlib.redirect_stdout(io.StringIO()):
+                _, wall, cpu = timed(normalize_data, raw_dir, normalized_dir, data_start, force=True, jobs=jobs)
+            record('normalize', wall, cpu, jobs=jobs)
+
+        _, wall, cpu = timed(load_csv_feeds, data_files)
+        record('csv_feed_load', wall, cpu)
+
+        market_data, wall, cpu = timed(load_market_data, data_files)
+        record('market_data_load', wall, cpu)
+
+        _, wall, cpu = timed(run_strategy, data_files, dates[0], end_date, market_data=market_data)
+        record('run_strategy', wall, cpu, engine='backtrader')
+
+        results = None
+        for engine in engines:
+            for jobs in (jobs_list if engine == 'backtrader' else [1]):
+                results, wall, cpu = timed(lambda: list(run_backtests(data_files, dates, end_date, market_data,
+                                                                      engine, jobs)))
+                record('entry_sweep', wall, cpu, engine=engine, jobs=jobs)
+
+        returns_file = work_dir / name / 'returns.csv'
+        write_returns(results, cryptos, returns_file)
+        _, wall, cpu = timed(compute_statistics, returns_file)
+        record('quantify', wall, cpu)
+
+        data = pd.read_csv(returns_file, parse_dates=['market_entry']).set_index('market_entry')
+        _, wall, cpu = timed(plot_heatmap, data, False, str(work_dir / name / 'heatmap.png'))
+        record('heatmap', wall, cpu)
+    return records
+
+def main():
+    DEFAULT_OUTPUT = "benchmark.json"
+
+    parser = argparse.ArgumentParser(description='Time every stage of the normalize/analyze/quantify/visualize pipeline.')
+    parser.add_argument('--datasets', nargs='+', choices=['startup', 'shipped', 'synthetic'],
+                      default=['startup', 'shipped', 'synthetic'],
+                      help='startup: cold start of every pipeline.py subcommand, '
+                           'shipped: data/raw and the coins of the README demo, '
+                           'synthetic: generated CoinGecko-shaped files (default: all)')
+    parser.add_argument('--coins', type=int, default=20, metavar='N',
+                      help='Number of synthetic coins (default: 20)')
+    parser.add_argument('--years', type=float, default=5, metavar='M',
+                      help='Years of synthetic daily data (default: 5)')
+    parser.add_argument('--seed', type=int, default=0,
+                      help='Seed of the synthetic data (default: 0)')
+    parser.add_argument('--entries', type=int, default=10, metavar='K',
+                      help='Number of market entry dates in the entry sweep (default: 10)')
+    parser.add_argument('--engines', nargs='+', choices=['backtrader', 'numpy'], default=['backtrader', 'numpy'],
+                      help='Engines to time the entry sweep with (default: both)')
+    parser.add_argument('--jobs', nargs='+', type=int, default=[1], metavar='N',
+                      help='Worker process counts to time normalization and backtrader sweeps with (default: 1)')
+    parser.add_argument('--repeat', type=int, default=1,
+                      help='Number of times to time every stage (default: 1)')
+    parser.add_argument('--work-dir', type=Path,
+                      help='Directory for generated files (default: a temporary directory, removed afterwards)')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, metavar='FILENAME',
+                      help=f'JSON file to write the timings to (default: {DEFAULT_OUTPUT})')
+    args = parser.parse_args()
+
+    if args.coins < 1 or args.years <= 0 or args.entries < 1 or args.repeat < 1:
+        parser.error("--coins, --years, --entries and --repeat must be positive")
+    if any(jobs < 1 for jobs in args.jobs):
+        parser.error("--jobs must be at least 1")
+
+    work_dir = args.work_dir or Path(tempfile.mkdtemp(prefix='benchmark-'))
+    work_dir.mkdir(parents=True, exist_ok=True)
+    print(f"{'Dataset':<10} {'Stage':<18} {'Engine':<11} {'Jobs':>4} {'Wall s':>10} {'CPU s':>10}")
+
+    records = []
+    try:
+        if 'startup' in args.datasets:
+            records += benchmark_startup(args.repeat)
+        if 'shipped' in args.datasets:
+            records += benchmark_dataset('shipped', Path('data/raw'), SHIPPED_CRYPTOS, valid_date("2013-01-01"),
+                                         valid_date("2018-01-01"), valid_date("2024-12-31"), work_dir,
+                                         args.entries, args.engines, args.jobs, args.repeat)
+        if 'synthetic' in args.datasets:
+            raw_dir = work_dir / 'synthetic' / 'raw'
+            start_date = generate_synthetic(raw_dir, args.coins, args.years, seed=args.seed)
+            cryptos = sorted(file.stem for file in raw_dir.glob('*.csv'))
+            # Enter once every coin is listed (all listings fall in the first half)
+            entry_start = start_date + timedelta(days=int(args.years * 365) // 2)
+            # Normalize from the day before the data so every file is rewritten with dates only,
+            # as normalize_data.py copies files that already cover the start date as they are
+            records += benchmark_dataset('synthetic', raw_dir, cryptos, start_date - timedelta(days=1), entry_start,
+                                         valid_date("2024-12-31"), work_dir,
+                                         args.entries, args.engines, args.jobs, args.repeat)
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir)
+
+    with open(args.output, 'w') as f:
+        json.dump({
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'environment': {
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'backtrader': bt.__version__,
+                'numpy': np.__version__,
+                'pandas': pd.__version__,
+            },
+            'settings': {key: str(value) if isinstance(value, Path) else value for key, value in vars(args).items()},
+            'results': records,
+        }, f, indent=2)
+    print(f"\nTimings written to {args.output}")
+
+if __name__ == '__main__':
+    main()
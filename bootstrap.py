@@ -0,0 +1,231 @@
+"""Block-bootstrap confidence intervals for the statistics of quantify.py.
+
+Resamples blocks of joint daily price and market-cap changes of the normalized
+data into thousands of synthetic histories, evaluates the market-cap index and
+every coin on all of them as batched NumPy arrays, and reports percentile
+intervals of the quantify.py statistics across histories.
+
+The index is modelled frictionless: like IndexComparisonStrategy it holds
+cash until its first rebalance and fills rebalances at the next day's price
+(the open of the feeds), but it holds fractional market-cap weights that
+drift with prices until the next rebalance. That way every history costs
+O(days x coins) instead of one backtest per entry date.
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import numpy as np
+from index_engine import align_market_data
+from market_data import load_market_data
+from pipeline import valid_date
+
+# Per-path statistics, in the order of quantify.py's report
+STATISTICS = ['worst_return', 'average_return', 'prob_less_than_index', 'prob_negative']
+
+def daily_changes(aligned, start_date=None, end_date=None):
+    """Return (log price changes, log market-cap changes, last market caps) of the days every coin traded.
+
+    Only days where every coin has a nonzero price and market cap on both the
+    day and the day before are kept, so each row is a joint move of all coins.
+    """
+    price, market_cap = aligned['price'], aligned['market_cap']
+    dates = aligned['dates']
+    traded = (price > 0).all(axis=1) & (market_cap > 0).all(axis=1)
+    kept = traded[1:] & traded[:-1]
+    if start_date is not None:
+        kept &= dates[1:] >= np.datetime64(start_date, 'D')
+    if end_date is not None:
+        kept &= dates[1:] <= np.datetime64(end_date, 'D')
+    rows = np.flatnonzero(kept) + 1
+    log_returns = np.log(price[rows] / price[rows - 1])
+    log_cap_changes = np.log(market_cap[rows] / market_cap[rows - 1])
+    last = rows[-1] if len(rows) else len(price) - 1
+    return log_returns, log_cap_changes, market_cap[last]
+
+def bootstrap_returns(log_returns, log_cap_changes, initial_caps, n_paths, n_days, entries,
+                      block_days=30, rebalance_days=30, rng=None):
+    """Simulate n_paths resampled histories of n_days and return the returns of every entry.
+
+    Histories are moving-block bootstraps of whole rows of the daily changes.
+    Entry dates are the first entries days of a history and all of them exit on
+    its last day. Returns an n_paths x entries x (1 + coins) array of returns
+    in percent, the index first.
+    """
+    rng = np.random.default_rng(rng)
+    n_history, n_coins = log_returns.shape
+    last = n_days  # day 0 is the first entry's close, days 1..n_days are resampled
+
+    n_blocks = -(-n_days // block_days)
+    starts = rng.integers(0, n_history - block_days + 1, size=(n_paths, n_blocks))
+    days = starts[:, :, None] + np.arange(1, block_days + 1)
+
+    def resampled_sums(changes, base):
+        """base plus the resampled changes summed up to every day, from running sums of the history."""
+        history = np.concatenate([np.zeros((1, n_coins)), np.cumsum(changes, axis=0)])
+        block_sums = history[starts + block_days] - history[starts]
+        offsets = base + np.cumsum(block_sums, axis=1) - block_sums - history[starts]
+        sums = history[days]
+        sums += offsets[:, :, None]
+        return sums.reshape(n_paths, -1, n_coins)[:, :n_days]
+
+    price = np.ones((n_paths, last + 1, n_coins))
+    np.exp(resampled_sums(log_returns, 0.0), out=price[:, 1:])
+    # Market caps of days 0..last-1, the days before a fill
+    caps = np.empty((n_paths, last, n_coins))
+    caps[:, 0] = initial_caps
+    np.exp(resampled_sums(log_cap_changes, np.log(initial_caps))[:, :-1], out=caps[:, 1:])
+    # Units of every coin per unit of index value bought by a rebalance filled on day t,
+    # at the market-cap weights of the day before
+    units = np.empty((n_paths, last + 1, n_coins))
+    units[:, 0] = np.nan
+    np.divide(caps, price[:, 1:], out=units[:, 1:])
+    units[:, 1:] /= caps.sum(axis=2, keepdims=True)
+    del caps
+
+    # Index growth of a full period from a rebalance filled on day t to the next one (before the last day)
+    full_days = max(last - rebalance_days, 0)
+    period_growth = np.zeros((n_paths, -(-last // rebalance_days) * rebalance_days))
+    period_growth[:, :full_days] = np.log(np.einsum('pdc,pdc->pd', units[:, :full_days], price[:, rebalance_days:last]))
+    # Sum of the log growths of the rebalances filled from day t on, every rebalance_days days
+    strided = period_growth.reshape(n_paths, -1, rebalance_days)
+    chained = np.cumsum(strided[:, ::-1], axis=1)[:, ::-1].reshape(n_paths, -1)
+    # Growth from a rebalance filled on day t to the last day
+    final_growth = np.einsum('pdc,pc->pd', units[:, :last], price[:, last])
+
+    # The strategy's day counter first hits the period rebalance_days - 1 days after entry,
+    # and the orders fill the next day
+    first = np.arange(entries) + rebalance_days
+    invested = first < last
+    first = np.minimum(first, last - 1)
+    final_rebalance = first + (last - 1 - first) // rebalance_days * rebalance_days
+    returns = np.empty((n_paths, entries, 1 + n_coins))
+    returns[:, :, 0] = np.where(invested, np.exp(chained[:, first]) * final_growth[:, final_rebalance] - 1, 0.0) * 100
+    returns[:, :, 1:] = (price[:, last, None] / price[:, :entries] - 1) * 100
+    return returns
+
+def path_statistics(returns):
+    """Reduce n_paths x entries x assets returns to n_paths x assets x STATISTICS (NaN where not defined)."""
+    statistics = np.empty(returns.shape[::2] + (len(STATISTICS),))
+    statistics[..., 0] = returns.min(axis=1)
+    statistics[..., 1] = returns.mean(axis=1)
+    statistics[..., 2] = (returns < returns[:, :, :1]).mean(axis=1)
+    statistics[:, 0, 2] = np.nan
+    statistics[..., 3] = (returns < 0).mean(axis=1)
+    return statistics
+
+def _init_worker(*args):
+    global _worker_args
+    _worker_args = args
+
+def _run_chunk(chunk):
+    n_paths, seed = chunk
+    log_returns, log_cap_changes, initial_caps, n_days, entries, block_days, rebalance_days = _worker_args
+    return path_statistics(bootstrap_returns(log_returns, log_cap_changes, initial_caps, n_paths, n_days, entries,
+                                             block_days, rebalance_days, np.random.default_rng(seed)))
+
+def run_bootstrap(log_returns, log_cap_changes, initial_caps, n_paths, n_days, entries, block_days=30,
+                  rebalance_days=30, seed=0, jobs=1, chunk_paths=50):
+    """Return n_paths x assets x STATISTICS for n_paths histories, simulated chunk_paths at a time.
+
+    Every chunk draws from its own seed spawned from seed, so results do not
+    depend on jobs.
+    """
+    sizes = [min(chunk_paths, n_paths - start) for start in range(0, n_paths, chunk_paths)]
+    chunks = list(zip(sizes, np.random.SeedSequence(seed).spawn(len(sizes))))
+    args = (log_returns, log_cap_changes, initial_caps, n_days, entries, block_days, rebalance_days)
+    if jobs <= 1:
+        _init_worker(*args)
+        return np.concatenate([_run_chunk(chunk) for chunk in chunks])
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=args) as executor:
+        return np.concatenate(list(executor.map(_run_chunk, chunks)))
+
+def confidence_intervals(statistics, confidence=0.95):
+    """Return the (lower, median, upper) percentiles of every statistic across paths, each assets x STATISTICS."""
+    tail = (1 - confidence) / 2 * 100
+    return tuple(np.percentile(statistics, [tail, 50, 100 - tail], axis=0))
+
+def write_intervals(names, intervals, confidence, output_file=None):
+    """Print the intervals in the layout of quantify.py, or write them as a Markdown table."""
+    lower, median, upper = intervals
+    percent = [False, False, True, True]
+
+    def cell(i, s):
+        if np.isnan(median[i, s]):
+            return "-"
+        if percent[s]:
+            return f"{median[i, s]:.2%} [{lower[i, s]:.2%}, {upper[i, s]:.2%}]"
+        return f"{median[i, s]:.2f} [{lower[i, s]:.2f}, {upper[i, s]:.2f}]"
+
+    if output_file:
+        with open(output_file, 'w') as md_file:
+            md_file.write("# Анализ эффективности криптовалют (bootstrap)\n\n")
+            md_file.write(f"Медиана [{confidence:.0%} доверительный интервал]\n\n")
+            md_file.write("| Актив | Худший<br>возврат, % | Усредненный<br>возврат, % | Вероятность<br>победы<br>индексной<br>стратегии, % | Вероятность<br>негативного<br>возврата, % |\n")
+            md_file.write("|-------|-----------------|-------------------|-------------------|---------------------|\n")
+            for i, name in enumerate(names):
+                md_file.write(f"| {name} | {' | '.join(cell(i, s) for s in range(len(STATISTICS)))} |\n")
+        print(f"Bootstrap results written to {output_file}")
+        return
+
+    titles = ["Worst returns", "Average returns", "Probability that return is smaller than index",
+              "Probability of losing money (negative return)"]
+    for s, title in enumerate(titles):
+        print(f"\n({s + 1}) {title}, median [{confidence:.0%} interval]:")
+        for i, name in enumerate(names):
+            if not np.isnan(median[i, s]):
+                print(f"{name}: {cell(i, s)}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Block-bootstrap confidence intervals of the index vs coin statistics.')
+    parser.add_argument('--cryptos', nargs='+', default=['bitcoin', 'ethereum', 'cardano'],
+                       help='List of cryptocurrencies to analyze (space-separated)')
+    parser.add_argument('--history', nargs=2, type=valid_date, metavar=('START', 'END'),
+                      help='Date range of the daily changes to resample (default: every day all coins traded)')
+    parser.add_argument('--paths', type=int, default=10000,
+                      help='Number of resampled histories (default: 10000)')
+    parser.add_argument('--years', type=float, default=7,
+                      help='Length of every history in years (default: 7)')
+    parser.add_argument('--entries', type=int, default=365,
+                      help='Number of daily market entry dates at the start of every history (default: 365)')
+    parser.add_argument('--block-days', type=int, default=30, metavar='DAYS',
+                      help='Length of the resampled blocks of days (default: 30)')
+    parser.add_argument('--rebalance-days', type=int, default=30, metavar='DAYS',
+                      help='Rebalance the index every DAYS days (default: 30)')
+    parser.add_argument('--confidence', type=float, default=0.95,
+                      help='Confidence level of the intervals (default: 0.95)')
+    parser.add_argument('--seed', type=int, default=0,
+                      help='Random seed (default: 0)')
+    parser.add_argument('--jobs', type=int, default=1, metavar='N',
+                      help='Number of worker processes (default: 1)')
+    parser.add_argument('--chunk-paths', type=int, default=50, metavar='N',
+                      help='Histories simulated at a time by a process, bounding its memory (default: 50)')
+    parser.add_argument('--output', help='Path to the output Markdown file (if not specified, prints to stdout)')
+    args = parser.parse_args()
+
+    n_days = int(args.years * 365)
+    if min(args.paths, args.entries, args.block_days, args.rebalance_days, args.jobs, args.chunk_paths) < 1:
+        parser.error("--paths, --entries, --block-days, --rebalance-days, --jobs and --chunk-paths must be at least 1")
+    if args.entries > n_days:
+        parser.error("--entries must not exceed the length of a history")
+    if not 0 < args.confidence < 1:
+        parser.error("--confidence must be between 0 and 1")
+
+    data_files = [(Path('data/normalized') / name).with_suffix('.csv') for name in args.cryptos]
+    try:
+        market_data = load_market_data(data_files)
+    except FileNotFoundError as e:
+        print(f"Failed to load market data: {str(e)}")
+        exit(1)
+    aligned = align_market_data(market_data, args.cryptos)
+    log_returns, log_cap_changes, initial_caps = daily_changes(aligned, *(args.history or ()))
+    if len(log_returns) < args.block_days:
+        parser.error(f"only {len(log_returns)} days where every coin traded, fewer than --block-days")
+    print(f"Resampling {len(log_returns)} days into {args.paths} histories of {n_days} days")
+
+    statistics = run_bootstrap(log_returns, log_cap_changes, initial_caps, args.paths, n_days, args.entries,
+                               args.block_days, args.rebalance_days, args.seed, args.jobs, args.chunk_paths)
+    write_intervals(['index'] + args.cryptos, confidence_intervals(statistics, args.confidence),
+                    args.confidence, args.output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""Command line client of server.py, writing its rows as returns.csv.
+
+Only imports the standard library, so a query costs an interpreter start and
+one local HTTP round trip.
+"""
+import argparse
+import json
+import sys
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+
+def query(url, path, body=None):
+    """POST body (or GET without one) to the server and return the decoded JSON response."""
+    data = None if body is None else json.dumps(body).encode()
+    request = Request(url.rstrip('/') + path, data=data, headers={'Content-Type': 'application/json'})
+    with urlopen(request) as response:
+        return json.load(response)
+
+def write_rows(response, output):
+    """Write a /run response in the returns.csv format."""
+    columns = response['columns']
+    output.write(f"{','.join(columns)}\n")
+    for row in response['rows']:
+        values = [row['market_entry']] + ["" if row[key] is None else f"{row[key]:.2f}" for key in columns[1:]]
+        output.write(",".join(values) + "\n")
+
+def main():
+    parser = argparse.ArgumentParser(description='Query a running server.py for index backtests.')
+    parser.add_argument('--url', default='http://127.0.0.1:8765',
+                      help='Server address (default: http://127.0.0.1:8765)')
+    parser.add_argument('--cryptos', nargs='+', default=['bitcoin', 'ethereum', 'cardano'],
+                       help='List of cryptocurrencies to analyze (space-separated), or "all"')
+    parser.add_argument('--start-interval', nargs=2, default=['2018-01-01', '2018-12-31'], metavar=('START', 'END'),
+                      help='Date range of market entries (default: 2018-01-01 to 2018-12-31)')
+    parser.add_argument('--end-date', default='2024-12-31', metavar='DATE',
+                      help='End date (default: 2024-12-31)')
+    parser.add_argument('--engine', choices=['backtrader', 'numpy'], default='numpy',
+                      help='Backtest engine of the server (default: numpy)')
+    parser.add_argument('--rebalance-days', type=int, default=30, metavar='DAYS',
+                      help='Rebalance the index every DAYS days (default: 30)')
+    parser.add_argument('--min-allocation', type=float, default=0.0, metavar='FRACTION',
+                      help='Minimum allocation threshold (default: 0, keep all)')
+    parser.add_argument('--top', type=int, metavar='N',
+                      help='Only hold the top N assets by market cap (default: hold all)')
+    parser.add_argument('--output', metavar='FILENAME',
+                      help='Output filename (default: print to stdout)')
+    parser.add_argument('--coins', action='store_true',
+                      help='List the coins the server has loaded and exit')
+    parser.add_argument('--reload', action='store_true',
+                      help='Make the server reload data/normalized and exit')
+    args = parser.parse_args()
+
+    try:
+        if args.coins or args.reload:
+            response = query(args.url, '/reload', {}) if args.reload else query(args.url, '/coins')
+            print(" ".join(response['coins']))
+            return
+        response = query(args.url, '/run', {
+            'cryptos': args.cryptos,
+            'start_interval': args.start_interval,
+            'end_date': args.end_date,
+            'engine': args.engine,
+            'rebalance_days': args.rebalance_days,
+            'min_allocation': args.min_allocation,
+            'top': args.top,
+        })
+    except HTTPError as e:
+        print(f"Query failed: {json.load(e).get('error', e.reason)}")
+        exit(1)
+    except URLError as e:
+        print(f"Could not reach {args.url} (start it with: python server.py): {e.reason}")
+        exit(1)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            write_rows(response, f)
+    else:
+        write_rows(response, sys.stdout)
+
+if __name__ == '__main__':
+    main()
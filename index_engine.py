@@ -0,0 +1,259 @@
+"""Vectorized market-cap index backtest over aligned price/market-cap arrays.
+
+Mirrors IndexComparisonStrategy running on backtrader's default broker (market
+orders sized with order_target_percent, filled at the next bar's open, margin
+checks on submission and execution), but simulates every market entry date at
+once as array operations instead of one Cerebro run per date.
+"""
+import numpy as np
+
+def align_market_data(market_data, names):
+    """Align coin records (see market_data.load_market_data) on the union of their dates.
+
+    Returns a dict with:
+      - dates: datetime64[D] clock of every step where all coins have a bar
+      - strategy_dates: date the strategy sees on each step (last bar of the first coin)
+      - price, market_cap: steps x coins arrays, carrying each coin's last bar forward
+      - new_bar: steps x coins mask of coins that have a bar on that very step
+      - weights: cache of index_weights() per minimum allocation and top
+    """
+    records = [market_data[name] for name in names]
+    dates = np.unique(np.concatenate([r['snapped_at'] for r in records]))
+
+    positions = np.empty((len(dates), len(records)), dtype=np.int64)
+    new_bar = np.empty((len(dates), len(records)), dtype=bool)
+    for i, r in enumerate(records):
+        positions[:, i] = np.searchsorted(r['snapped_at'], dates, side='right') - 1
+        new_bar[:, i] = np.isin(dates, r['snapped_at'])
+
+    # backtrader only calls next() once every feed has delivered a bar
+    started = (positions >= 0).all(axis=1)
+    positions = positions[started]
+    new_bar = new_bar[started]
+
+    price = np.empty(positions.shape)
+    market_cap = np.empty(positions.shape)
+    for i, r in enumerate(records):
+        price[:, i] = r['price'][positions[:, i]]
+        market_cap[:, i] = r['market_cap'][positions[:, i]]
+
+    return {
+        'names': list(names),
+        'dates': dates[started],
+        'strategy_dates': records[0]['snapped_at'][positions[:, 0]],
+        'price': price,
+        'market_cap': market_cap,
+        'new_bar': new_bar,
+        'weights': {},
+    }
+
+def top_n_mask(price, market_cap, top):
+    """Steps x coins mask of the top coins by market cap among those with a nonzero price and a known cap.
+
+    Uses a partial sort (np.partition) per step rather than a full ranking; ties
+    at the cut-off go to the coin that comes first.
+    """
+    caps = np.where((price > 0) & ~np.isnan(market_cap), market_cap, -np.inf)
+    if top >= caps.shape[1]:
+        return caps > -np.inf
+    threshold = np.partition(caps, -top, axis=1)[:, -top]
+    above = caps > threshold[:, None]
+    ties = caps == threshold[:, None]
+    remaining = top - above.sum(axis=1)
+    return (above | (ties & (np.cumsum(ties, axis=1) <= remaining[:, None]))) & (caps > -np.inf)
+
+def market_cap_weights(price, market_cap, min_allocation=0.0, top=None):
+    """Market-cap share of every coin with a nonzero price, per step (NaN where not held).
+
+    With top, only the top coins by market cap (see top_n_mask) share the
+    index and other held coins get weight 0. With a min_allocation, coins below
+    it get weight 0 and the others are scaled back up to a total of 1; steps
+    where no coin reaches it are all NaN.
+    """
+    held = price > 0
+    included = top_n_mask(price, market_cap, top) if top else held
+    # Accumulate coin by coin so totals match the strategy's sequential sum()
+    total = np.zeros(len(price))
+    for i in range(price.shape[1]):
+        total = total + np.where(included[:, i], market_cap[:, i], 0.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        weights = np.where(included, market_cap / total[:, None], np.nan)
+    if top:
+        # Held coins outside the top are sold, unless nothing ranks at all
+        weights = np.where(held & ~included & included.any(axis=1)[:, None], 0.0, weights)
+    if not min_allocation:
+        return weights
+
+    kept = weights >= min_allocation
+    kept_total = np.zeros(len(price))
+    for i in range(price.shape[1]):
+        kept_total = kept_total + np.where(kept[:, i], weights[:, i], 0.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scaled = np.where(kept, weights / kept_total[:, None], 0.0)
+    return np.where(held & kept.any(axis=1)[:, None], scaled, np.nan)
+
+def index_weights(aligned, min_allocation=0.0, top=None):
+    """Weights of aligned data for a minimum allocation and top, computed once and cached in aligned."""
+    key = (min_allocation, top)
+    if key not in aligned['weights']:
+        aligned['weights'][key] = market_cap_weights(aligned['price'], aligned['market_cap'], min_allocation, top)
+    return aligned['weights'][key]
+
+def weight_table(aligned, min_allocation=0.0, top=None, columns=None):
+    """Read-only (dates, dates x coins weights) table shared by IndexComparisonStrategy instances.
+
+    columns selects (and orders) the coins the strategy's feeds hold.
+    """
+    weights = index_weights(aligned, min_allocation, top)
+    if columns is not None:
+        weights = weights[:, columns]
+    weights.flags.writeable = False
+    return aligned['dates'], weights
+
+def traded_columns(aligned, weights, start_dates, end_date):
+    """Coins a run from any of start_dates to end_date can trade, plus those it needs for its clock.
+
+    A coin is traded if it has a nonzero weight on some step of the runs. Other
+    coins can be left out of a backtest unless they are the first coin (the
+    strategy's clock) or have bars on steps where no traded coin has one, since
+    every bar advances the clock.
+    """
+    steps = slice(np.searchsorted(aligned['strategy_dates'], np.datetime64(min(start_dates), 'D'), side='left'),
+                  np.searchsorted(aligned['strategy_dates'], np.datetime64(end_date, 'D'), side='right'))
+    with np.errstate(invalid='ignore'):
+        traded = (weights[steps] > 0).any(axis=0)
+    traded[0] = True
+    new_bar = aligned['new_bar'][steps]
+    covered = new_bar[:, traded].any(axis=1)
+    traded |= (new_bar & ~covered[:, None]).any(axis=0)
+    return np.flatnonzero(traded)
+
+def constituent_returns(aligned, first, last):
+    """Return of every coin from its first to last nonzero close within steps [first, last] of every run.
+
+    Returns an entries x coins array, NaN where a run has fewer than two
+    nonzero closes of the coin (or no steps at all).
+    """
+    price = aligned['price']
+    held = price > 0
+    n_steps, n_coins = price.shape
+    steps = np.broadcast_to(np.arange(n_steps)[:, None], price.shape)
+    next_nonzero = np.minimum.accumulate(np.where(held, steps, n_steps)[::-1], axis=0)[::-1]
+    prev_nonzero = np.maximum.accumulate(np.where(held, steps, -1), axis=0)
+    coins = np.arange(n_coins)
+    initial = next_nonzero[np.minimum(first, n_steps - 1)]
+    final = prev_nonzero[np.maximum(last, 0)]
+    has_return = (first <= last)[:, None] & (initial < final)
+    initial_price = price[np.minimum(initial, n_steps - 1), coins]
+    final_price = price[np.maximum(final, 0), coins]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(has_return, (final_price - initial_price) / initial_price * 100, np.nan)
+
+def entry_steps(aligned, start_dates, end_date):
+    """First and last step of the runs from every start date to end_date."""
+    strategy_dates = aligned['strategy_dates']
+    first = np.searchsorted(strategy_dates, np.array(start_dates, dtype='datetime64[D]'), side='left')
+    last = np.full(len(first), np.searchsorted(strategy_dates, np.datetime64(end_date, 'D'), side='right') - 1)
+    return first, last
+
+def run_index_engine(market_data, names, start_dates, end_date, rebalance_days=30, min_allocation=0.0,
+                     cash=1000000.0, aligned=None, top=None):
+    """Backtest the index for every market entry date in one batched pass.
+
+    Pass aligned (from align_market_data) to share the aligned arrays and their
+    weights across calls. Returns one result dict per entry date in the same
+    shape as IndexComparisonStrategy.result (market_entry, index, then constituents).
+    """
+    return run_index_engine_horizons(market_data, names, start_dates, [end_date], rebalance_days, min_allocation,
+                                     cash, aligned, top)[end_date]
+
+def run_index_engine_horizons(market_data, names, start_dates, end_dates, rebalance_days=30, min_allocation=0.0,
+                              cash=1000000.0, aligned=None, top=None):
+    """Like run_index_engine for several end dates, simulating each entry date only once.
+
+    Returns {end_date: results}, each identical to run_index_engine with that end date.
+    """
+    if aligned is None:
+        aligned = align_market_data(market_data, names)
+    price = aligned['price']
+    new_bar = aligned['new_bar']
+    weights = index_weights(aligned, min_allocation, top)
+    held = price > 0
+    tradable = ~np.isnan(weights).all(axis=1)
+
+    # Window of steps each entry date records, [first, last]
+    strategy_dates = aligned['strategy_dates']
+    starts = np.array(start_dates, dtype='datetime64[D]')
+    first = np.searchsorted(strategy_dates, starts, side='left')
+    # Last step of every horizon; the simulation runs to the latest one and snapshots the others
+    horizons = np.searchsorted(strategy_dates, np.array(end_dates, dtype='datetime64[D]'), side='right') - 1
+    last = np.full(len(starts), horizons.max(initial=-1))
+    n_entries, n_coins = len(starts), len(names)
+
+    balance = np.full(n_entries, float(cash))
+    position = np.zeros((n_entries, n_coins))
+    order_size = np.zeros((n_entries, n_coins))   # signed, 0 when no order
+    order_price = np.zeros((n_entries, n_coins))  # close at order creation
+    accepted = np.zeros((n_entries, n_coins), dtype=bool)
+    start_value = np.full(n_entries, np.nan)
+    final_value = np.full((n_entries, len(horizons)), np.nan)
+
+    for step in range(first.min(initial=len(strategy_dates)), last.max(initial=-1) + 1):
+        # Broker: margin check on orders submitted last step, in submission order
+        submitted = (order_size != 0) & ~accepted
+        if submitted.any():
+            running = balance[:, None] + np.cumsum(np.where(submitted, -order_size * order_price, 0.0), axis=1)
+            accepted |= submitted & (running >= 0)
+            order_size[submitted & (running < 0)] = 0
+
+        # Broker: fill accepted orders at this bar's open once the coin has a new bar
+        fills = accepted & new_bar[step]
+        if fills.any():
+            open_price = price[step]
+            for i in np.flatnonzero(fills.any(axis=0)):
+                cost = order_size[:, i] * open_price[i]
+                # Buys that no longer fit in cash are rejected, sells always fill
+                fill = fills[:, i] & ((order_size[:, i] < 0) | (balance - cost >= 0))
+                balance = np.where(fill, balance - cost, balance)
+                position[:, i] = np.where(fill, position[:, i] + order_size[:, i], position[:, i])
+            order_size[fills] = 0
+            accepted &= ~fills
+
+        active = (first <= step) & (step <= last)
+        if not active.any():
+            continue
+        value = balance + position @ price[step]
+        start_value = np.where(step == first, value, start_value)
+        final_value[:, horizons == step] = value[:, None]
+
+        # Strategy: rebalance entries whose day counter hits the period
+        rebalancing = active & ((step - first + 1) % rebalance_days == 0)
+        if not rebalancing.any() or not tradable[step]:
+            continue
+        close = price[step]
+        target = weights[step] * value[rebalancing, None]
+        current = position[rebalancing] * close
+        with np.errstate(invalid='ignore'):
+            size = np.where(target > current, np.floor_divide(target - current, np.where(held[step], close, 1.0)), 0.0)
+            size = np.where(target < current, -np.floor_divide(current - target, np.where(held[step], close, 1.0)), size)
+        # A zero weight closes the whole position
+        size = np.where((weights[step] == 0) & (position[rebalancing] != 0), -position[rebalancing], size)
+        size = np.where(held[step], size, 0.0)
+        order_size[rebalancing] = size
+        order_price[rebalancing] = close
+        accepted[rebalancing] = False
+
+    results = {}
+    for h, end_date in enumerate(end_dates):
+        valid = first <= horizons[h]
+        coin_returns = constituent_returns(aligned, first, np.full(n_entries, horizons[h]))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            index_returns = (final_value[:, h] - start_value) / start_value * 100
+
+        results[end_date] = []
+        for e in np.flatnonzero(valid):
+            result = {'market_entry': starts[e].astype(object), 'index': index_returns[e]}
+            for i in np.flatnonzero(~np.isnan(coin_returns[e])):
+                result[names[i]] = coin_returns[e, i]
+            results[end_date].append(result)
+    return results
@@ -0,0 +1,132 @@
+"""Normalized CoinGecko data as NumPy records, with a memory-mapped columnar cache.
+
+normalize_data.py writes a ``<coin>.npy`` next to every ``<coin>.csv`` it
+produces. load_market_data() memory-maps those files when they are at least as
+new as their CSV and only falls back to parsing the CSV otherwise.
+"""
+import io
+from pathlib import Path
+import numpy as np
+
+# Columns of a normalized CoinGecko file as held in memory and in the .npy cache
+MARKET_DTYPE = np.dtype([
+    ('snapped_at', 'datetime64[D]'),
+    ('price', 'f8'),
+    ('market_cap', 'f8'),
+    ('total_volume', 'f8'),
+])
+
+def columnar_path(csv_file):
+    """Path of the columnar cache belonging to a normalized CSV file."""
+    return Path(csv_file).with_suffix('.npy')
+
+def read_normalized_csv(csv_file):
+    """Parse a normalized CSV file into MARKET_DTYPE records."""
+    import pandas as pd
+
+    # round_trip keeps floats bit-identical to the float() parsing of GenericCSVData
+    frame = pd.read_csv(csv_file, float_precision='round_trip')
+    records = np.empty(len(frame), dtype=MARKET_DTYPE)
+    records['snapped_at'] = pd.to_datetime(frame['snapped_at']).values.astype('datetime64[D]')
+    for column in ('price', 'market_cap', 'total_volume'):
+        records[column] = frame[column].to_numpy(dtype='f8')
+    return records
+
+def make_records(dates, price, market_cap, total_volume):
+    """Build MARKET_DTYPE records from YYYY-MM-DD date strings and value columns."""
+    records = np.empty(len(dates), dtype=MARKET_DTYPE)
+    records['snapped_at'] = np.array(dates, dtype='datetime64[D]')
+    records['price'] = price
+    records['market_cap'] = market_cap
+    records['total_volume'] = total_volume
+    return records
+
+def save_columnar(csv_file, records):
+    """Write records as the columnar cache of a normalized CSV file and return its path."""
+    output_file = columnar_path(csv_file)
+    np.save(output_file, records)
+    return output_file
+
+def write_columnar(csv_file):
+    """Write the columnar cache of a normalized CSV file by parsing it, and return its path."""
+    return save_columnar(csv_file, read_normalized_csv(csv_file))
+
+def append_columnar(csv_file, records):
+    """Append records to the columnar cache of csv_file.
+
+    Only the array header and the new records are written. Caches whose header
+    would change size are rewritten from the CSV instead. Returns the number of
+    appended rows.
+    """
+    cache = columnar_path(csv_file)
+    if not cache.exists():
+        write_columnar(csv_file)
+        return len(records)
+
+    with open(cache, 'r+b') as f:
+        version = np.lib.format.read_magic(f)
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f) if version == (1, 0) else (None, None, None)
+        data_offset = f.tell()
+        if dtype == MARKET_DTYPE and not fortran_order and len(shape) == 1:
+            header = io.BytesIO()
+            np.lib.format.write_array_header_1_0(header, {
+                'descr': np.lib.format.dtype_to_descr(MARKET_DTYPE),
+                'fortran_order': False,
+                'shape': (shape[0] + len(records),),
+            })
+            if header.tell() == data_offset:
+                f.seek(0)
+                f.write(header.getvalue())
+                f.seek(0, io.SEEK_END)
+                f.write(records.tobytes())
+                return len(records)
+
+    write_columnar(csv_file)
+    return len(records)
+
+def load_market_data(data_files):
+    """Load normalized data files once into records keyed by coin name.
+
+    Up-to-date .npy caches are memory-mapped read-only, so slices taken from
+    them never copy; stale or missing caches fall back to parsing the CSV.
+    """
+    market_data = {}
+    for file in data_files:
+        if not file.exists():
+            raise FileNotFoundError(f"File {file} not found")
+
+        cache = columnar_path(file)
+        if cache.exists() and cache.stat().st_mtime >= file.stat().st_mtime:
+            records = np.load(cache, mmap_mode='r')
+            if records.dtype == MARKET_DTYPE:
+                market_data[file.stem] = records
+                continue
+
+        market_data[file.stem] = read_normalized_csv(file)
+    return market_data
+
+def window_market_data(market_data, names, start_date=None, end_date=None):
+    """Slice each coin's records (zero-copy) to the bars a run from start_date to end_date uses.
+
+    Every coin keeps its last bar at or before start_date so all feeds are live on
+    the entry date, and bars are cut where the first coin (the strategy's clock)
+    moves past end_date.
+    """
+    cutoff = None
+    if end_date is not None:
+        clock = market_data[names[0]]['snapped_at']
+        after_end = np.searchsorted(clock, np.datetime64(end_date, 'D'), side='right')
+        if after_end < len(clock):
+            cutoff = clock[after_end] - np.timedelta64(1, 'D')
+
+    windowed = {}
+    for name in names:
+        records = market_data[name]
+        dates = records['snapped_at']
+        lo = 0
+        if start_date is not None:
+            lo = max(np.searchsorted(dates, np.datetime64(start_date, 'D'), side='right') - 1, 0)
+        hi = len(records) if cutoff is None else np.searchsorted(dates, cutoff, side='right')
+        windowed[name] = records[lo:hi]
+    return windowed
+
@@ -1,17 +1,20 @@
 #!/usr/bin/env python3
-import argparse
+import hashlib
+import json
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
+from itertools import repeat
 from pathlib import Path
-import pandas as pd
+import numpy as np
 import sys
 import shutil
+from market_data import MARKET_DTYPE, append_columnar, columnar_path, make_records, save_columnar
 
-def valid_date(date_string):
-    """Validate date format YYYY-MM-DD"""
-    try:
-        return datetime.strptime(date_string, "%Y-%m-%d").date()
-    except ValueError:
-        raise argparse.ArgumentTypeError(f"Invalid date: '{date_string}'. Expected format: YYYY-MM-DD")
+# Record of the raw files behind the normalized ones, kept in the normalized directory
+MANIFEST_NAME = 'manifest.json'
+NORMALIZED_HEADER = "snapped_at,price,market_cap,total_volume\n"
+NAN = float('nan')
 
 def setup_directories(data_dir):
     """Create normalized directory if it doesn't exist."""
@@ -29,73 +32,180 @@ def setup_directories(data_dir):
     
     return raw_dir, normalized_dir
 
-def normalize_data(raw_dir, normalized_dir, start_date):
-    """Create normalized versions of CSV files, adding zero values when needed."""
-    for csv_file in raw_dir.glob("*.csv"):
-        print(f"\nProcessing {csv_file.name}...")
-        
-        # Read the first line to get the first date
+def file_digests(csv_file, prefix_size=None):
+    """Return SHA-256 hex digests of the first prefix_size bytes and of the whole file."""
+    digest = hashlib.sha256()
+    prefix_digest = None
+    with open(csv_file, 'rb') as f:
+        if prefix_size is not None:
+            digest.update(f.read(prefix_size))
+            prefix_digest = digest.copy().hexdigest()
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return prefix_digest, digest.hexdigest()
+
+def load_manifest(normalized_dir):
+    """Load the record of raw files as of the previous run (empty if there is none)."""
+    manifest_file = normalized_dir / MANIFEST_NAME
+    if not manifest_file.exists():
+        return {}
+    with open(manifest_file) as f:
+        return json.load(f)
+
+def save_manifest(normalized_dir, manifest):
+    with open(normalized_dir / MANIFEST_NAME, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+def normalize_lines(lines, out=None):
+    """Parse raw CoinGecko CSV rows, writing them to out with YYYY-MM-DD dates if given.
+
+    Rows are streamed one at a time and their values collected column by column,
+    so a file never has to sit in memory as a DataFrame. Returns MARKET_DTYPE records.
+    """
+    dates = []
+    columns = (array('d'), array('d'), array('d'))
+    for line in lines:
+        fields = line.rstrip('\r\n').split(',')
+        if fields == ['']:
+            continue
+        day = fields[0][:10]
+        values = [float(field) if field else NAN for field in fields[1:4]]
+        dates.append(day)
+        for column, value in zip(columns, values):
+            column.append(value)
+        if out is not None:
+            out.write(day + ',' + ','.join('' if value != value else repr(value) for value in values) + '\n')
+    return make_records(dates, *columns)
+
+def normalize_file(csv_file, normalized_dir, start_date):
+    """Write the normalized version of one raw file.
+
+    Returns (copied, message) where copied is True if the file was copied as is,
+    False if it was padded with zero values, or None if nothing was written.
+    """
+    # Read the first line to get the first date
+    with open(csv_file, 'r') as f:
+        header = f.readline()
+        first_data_line = f.readline()
+    if not first_data_line:
+        return None, f"  Warning: File {csv_file.name} is empty"
+
+    first_date_str = first_data_line.split(',')[0]
+    first_date = datetime.strptime(first_date_str, "%Y-%m-%d %H:%M:%S UTC").date()
+    output_file = normalized_dir / csv_file.name
+
+    if first_date <= start_date:
+        # If file starts before or at start_date, just copy it
+        shutil.copy2(csv_file, output_file)
         with open(csv_file, 'r') as f:
-            header = f.readline()
-            first_data_line = f.readline()
-            if not first_data_line:
-                print(f"  Warning: File {csv_file.name} is empty")
-                continue
-                
-            first_date_str = first_data_line.split(',')[0]
-            first_date = datetime.strptime(first_date_str, "%Y-%m-%d %H:%M:%S UTC").date()
-            
-            if first_date <= start_date:
-                # If file starts before or at start_date, just copy it
-                output_file = normalized_dir / csv_file.name
-                shutil.copy2(csv_file, output_file)
-                print(f"  Copied file as is (first date {first_date} is before or at start date {start_date})")
-                continue
-            
-            # Generate dates between start_date and first_date
-            dates = []
-            current_date = start_date
-            while current_date < first_date:
-                dates.append(current_date)
-                current_date += timedelta(days=1)
-            
-            if not dates:
-                print("  No dates to add")
-                continue
-            
-            # Create DataFrame with zero values
-            zero_data = pd.DataFrame({
-                'snapped_at': [date.isoformat() for date in dates],  # Use YYYY-MM-DD format
-                'price': [0.0] * len(dates),
-                'market_cap': [0.0] * len(dates),
-                'total_volume': [0.0] * len(dates)
-            })
-            
-            # Read existing data and convert dates to YYYY-MM-DD format
-            existing_data = pd.read_csv(csv_file)
-            existing_data['snapped_at'] = pd.to_datetime(existing_data['snapped_at']).dt.date.astype(str)
-            
-            # Combine and write to normalized directory
-            combined_data = pd.concat([zero_data, existing_data], ignore_index=True)
-            output_file = normalized_dir / csv_file.name
-            combined_data.to_csv(output_file, index=False)
-            
-            print(f"  Created normalized version with {len(dates)} days of zero values from {start_date} to {first_date - timedelta(days=1)}")
-
-def main():
-    parser = argparse.ArgumentParser(description='Normalize historical data by adding zero values for dates before first recorded data point.')
-    parser.add_argument('--start-date', type=valid_date, required=True,
-                      help='Start date in YYYY-MM-DD format')
-    parser.add_argument('--data-dir', type=str, default='data',
-                      help='Directory containing raw and normalized subdirectories (default: data)')
-    
-    args = parser.parse_args()
-    
-    # Setup directories
-    raw_dir, normalized_dir = setup_directories(args.data_dir)
-    
-    # Create normalized versions
-    normalize_data(raw_dir, normalized_dir, args.start_date)
+            next(f)  # header
+            save_columnar(output_file, normalize_lines(f))
+        return True, f"  Copied file as is (first date {first_date} is before or at start date {start_date})"
+
+    # Dates between start_date and first_date get zero values
+    zero_dates = np.arange(np.datetime64(start_date, 'D'), np.datetime64(first_date, 'D'))
+    if not len(zero_dates):
+        return None, "  No dates to add"
+
+    # Stream the zero values followed by the existing rows with YYYY-MM-DD dates
+    with open(csv_file, 'r') as f, open(output_file, 'w') as out:
+        next(f)  # header
+        out.write(NORMALIZED_HEADER)
+        out.writelines(f"{day},0.0,0.0,0.0\n" for day in zero_dates.astype(str))
+        records = normalize_lines(f, out)
+
+    zero_records = np.zeros(len(zero_dates), dtype=MARKET_DTYPE)
+    zero_records['snapped_at'] = zero_dates
+    save_columnar(output_file, np.concatenate([zero_records, records]))
+
+    return False, f"  Created normalized version with {len(zero_dates)} days of zero values from {start_date} to {first_date - timedelta(days=1)}"
+
+def append_rows(csv_file, normalized_dir, offset, copied):
+    """Append the raw rows found after byte offset to the normalized file, returning their count."""
+    with open(csv_file, 'rb') as f:
+        f.seek(offset)
+        new_bytes = f.read()
+
+    output_file = normalized_dir / csv_file.name
+    new_lines = new_bytes.decode().splitlines(keepends=True)
+    if copied:
+        # Copied files keep the raw format, so the new bytes go in verbatim
+        with open(output_file, 'ab') as out:
+            out.write(new_bytes)
+        records = normalize_lines(new_lines)
+    else:
+        with open(output_file, 'a') as out:
+            records = normalize_lines(new_lines, out)
+    return append_columnar(output_file, records)
+
+def process_raw_file(csv_file, normalized_dir, start_date, entry=None):
+    """Bring the normalized files of one raw file up to date.
+
+    entry is the file's record from the previous run's manifest. Unchanged files
+    are skipped and files that only gained trailing rows are appended to.
+    Returns (manifest entry or None, message).
+    """
+    stat = csv_file.stat()
+    output_file = normalized_dir / csv_file.name
+    reusable = (entry is not None
+                and entry['start_date'] == start_date.isoformat()
+                and output_file.exists()
+                and columnar_path(output_file).exists())
+
+    if reusable and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+        return entry, "  Unchanged since last run, skipped"
+
+    if reusable and stat.st_size >= entry['size']:
+        prefix_digest, digest = file_digests(csv_file, entry['size'])
+        if prefix_digest == entry['sha256']:
+            if stat.st_size == entry['size']:
+                message = "  Unchanged since last run (only touched), skipped"
+            else:
+                rows = append_rows(csv_file, normalized_dir, entry['size'], entry['copied'])
+                message = f"  Appended {rows} new rows"
+            return dict(entry, size=stat.st_size, mtime_ns=stat.st_mtime_ns, sha256=digest), message
+
+    copied, message = normalize_file(csv_file, normalized_dir, start_date)
+    if copied is None:
+        return None, message
+    return {
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'sha256': file_digests(csv_file)[1],
+        'start_date': start_date.isoformat(),
+        'copied': copied,
+    }, message
+
+def normalize_data(raw_dir, normalized_dir, start_date, force=False, jobs=1):
+    """Create normalized versions of CSV files, adding zero values when needed.
+
+    Each normalized CSV also gets a columnar .npy copy that analyze.py memory-maps.
+    Raw files recorded in the manifest as unchanged since the previous run are
+    skipped, and files that only gained trailing rows are updated by appending
+    those rows; force rebuilds everything. Files are spread over jobs processes.
+    """
+    manifest = {} if force else load_manifest(normalized_dir)
+    csv_files = list(raw_dir.glob("*.csv"))
+    entries = [manifest.get(csv_file.name) for csv_file in csv_files]
+
+    if jobs > 1:
+        executor = ProcessPoolExecutor(max_workers=jobs)
+        results = executor.map(process_raw_file, csv_files, repeat(normalized_dir), repeat(start_date), entries)
+    else:
+        executor = None
+        results = map(process_raw_file, csv_files, repeat(normalized_dir), repeat(start_date), entries)
+
+    updated_manifest = {}
+    for csv_file, (entry, message) in zip(csv_files, results):
+        print(f"\nProcessing {csv_file.name}...")
+        print(message)
+        if entry is not None:
+            updated_manifest[csv_file.name] = entry
+
+    if executor is not None:
+        executor.shutdown()
+    save_manifest(normalized_dir, updated_manifest)
 
 if __name__ == '__main__':
-    main() 
\ No newline at end of file
+    from pipeline import run_script
+    run_script('normalize')
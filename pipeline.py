@@ -0,0 +1,437 @@
+"""Single entry point of the pipeline: normalize, analyze, quantify and plot subcommands.
+
+    python pipeline.py analyze --cryptos btc eth --then quantify --then plot --output heatmap
+
+Subcommands take the options of normalize_data.py, analyze.py, quantify.py and
+visualize.py (which now run through here). Only the standard library is
+imported up front; backtrader, pandas, matplotlib and seaborn are imported by
+the subcommands that use them, so --help and light commands start fast.
+Commands chained with --then run in one process, and quantify and plot take
+the returns of a preceding analyze from memory instead of re-reading the file.
+"""
+import argparse
+import cProfile
+import logging
+import os
+import sys
+from collections import namedtuple
+from contextlib import nullcontext
+from datetime import date, timedelta
+from pathlib import Path
+
+CHAIN_SEPARATOR = '--then'
+
+# Rows analyze writes at a time; --incremental runs checkpoint their output after every batch
+WRITE_BATCH = 100
+
+# Keys of analyze.ANALYZERS, listed here so parsing does not import backtrader
+ANALYZER_NAMES = ('returns', 'sharpe', 'drawdown')
+
+# A returns.csv table in memory: ISO entry dates, value columns, dates x columns floats (NaN where empty)
+Returns = namedtuple('Returns', ['dates', 'columns', 'values'])
+
+def valid_date(date_string):
+    """Validate date format YYYY-MM-DD"""
+    try:
+        return date.fromisoformat(date_string)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid date: '{date_string}'. Expected format: YYYY-MM-DD")
+
+def date_range(spec):
+    """Validate an end date YYYY-MM-DD or range START:END:DAYS, returned as a list of dates"""
+    parts = spec.split(':')
+    if len(parts) == 1:
+        return [valid_date(spec)]
+    if len(parts) != 3 or not parts[2].isdigit() or int(parts[2]) < 1:
+        raise argparse.ArgumentTypeError(f"Invalid date range: '{spec}'. Expected format: START:END:DAYS")
+    start, end, step = valid_date(parts[0]), valid_date(parts[1]), timedelta(days=int(parts[2]))
+    if start > end:
+        raise argparse.ArgumentTypeError(f"Invalid date range: '{spec}'. START must not be after END")
+    dates = []
+    while start <= end:
+        dates.append(start)
+        start += step
+    return dates
+
+def analyzer_list(names):
+    """Validate a comma-separated list of ANALYZER_NAMES"""
+    analyzers = [name.strip() for name in names.split(',') if name.strip()]
+    unknown = [name for name in analyzers if name not in ANALYZER_NAMES]
+    if unknown:
+        raise argparse.ArgumentTypeError(f"Unknown analyzers: {', '.join(unknown)}. Choose from: {', '.join(ANALYZER_NAMES)}")
+    return list(dict.fromkeys(analyzers))
+
+def returns_matrix(columns, rows):
+    """Build Returns from returns.csv lines (without header) keyed by entry date, in date order."""
+    import numpy as np
+
+    dates = sorted(rows)
+    values = np.array([[float(cell) if cell else np.nan for cell in rows[entry].split(',')[1:]] for entry in dates],
+                      dtype=float).reshape(len(dates), len(columns))
+    return Returns(dates, list(columns), values)
+
+def add_normalize_arguments(parser):
+    parser.add_argument('--start-date', type=valid_date, required=True,
+                      help='Start date in YYYY-MM-DD format')
+    parser.add_argument('--data-dir', type=str, default='data',
+                      help='Directory containing raw and normalized subdirectories (default: data)')
+    parser.add_argument('--force', action='store_true',
+                      help='Renormalize every raw file, ignoring the manifest of the previous run')
+    parser.add_argument('--jobs', type=int, default=1,
+                      help='Number of worker processes normalizing files in parallel (default: 1)')
+
+def normalize_command(parser, args, returns=None):
+    from normalize_data import normalize_data, setup_directories
+
+    # Setup directories
+    raw_dir, normalized_dir = setup_directories(args.data_dir)
+
+    # Create normalized versions
+    normalize_data(raw_dir, normalized_dir, args.start_date, args.force, args.jobs)
+    return returns
+
+def add_analyze_arguments(parser):
+    DEFAULT_START_INTERVAL0 = valid_date("2018-01-01")
+    DEFAULT_START_INTERVAL1 = valid_date("2018-12-31")
+    DEFAULT_END = valid_date("2024-12-31")
+    DEFAULT_OUTPUT = "returns.csv"
+
+    parser.add_argument('--cryptos', nargs='+', default=['bitcoin', 'ethereum', 'cardano'],
+                       help='List of cryptocurrencies to analyze (space-separated), '
+                            'or "all" for every file in data/normalized')
+    parser.add_argument('--start-interval', nargs=2, type=valid_date,
+                   default=[DEFAULT_START_INTERVAL0, DEFAULT_START_INTERVAL1],
+                   metavar=('START', 'END'),
+                   help=f'Date range (default: {DEFAULT_START_INTERVAL0} to {DEFAULT_START_INTERVAL1})')
+    end_group = parser.add_mutually_exclusive_group()
+    end_group.add_argument('--end-date', type=valid_date,
+                      default=DEFAULT_END,
+                      metavar='DATE',
+                      help=f'Single end date (default: {DEFAULT_END})')
+    end_group.add_argument('--end-dates', nargs='+', type=date_range,
+                      metavar='DATE|START:END:DAYS',
+                      help='Several end dates or ranges of them, computed in one run per entry date; '
+                           'the output becomes a market_entry,market_exit,asset,return table')
+    parser.add_argument('--output', type=str,
+                      default=DEFAULT_OUTPUT,
+                      metavar='FILENAME',
+                      help=f'Output filename (default: {DEFAULT_OUTPUT})')
+    parser.add_argument('--jobs', type=int, default=1,
+                      metavar='N',
+                      help='Number of worker processes for market entry dates (default: 1)')
+    parser.add_argument('--engine', choices=['backtrader', 'numpy'], default='backtrader',
+                      help='Backtest with one backtrader Cerebro per entry date or with the '
+                           'vectorized NumPy engine for all dates at once (default: backtrader)')
+    parser.add_argument('--rebalance-days', type=int, default=30,
+                      metavar='DAYS',
+                      help='Rebalance the index every DAYS days (default: 30)')
+    parser.add_argument('--min-allocation', type=float, default=0.0,
+                      metavar='FRACTION',
+                      help='Drop assets whose market-cap weight is below FRACTION (e.g. 0.01) at a rebalance '
+                           'and spread their weight over the rest (default: 0, keep all)')
+    parser.add_argument('--top', type=int,
+                      metavar='N',
+                      help='Only hold the top N assets by market cap at each rebalance, selling those that '
+                           'drop out (default: hold all)')
+    parser.add_argument('--broker', choices=['backtrader', 'batch'], default='backtrader',
+                      help='backtrader: one order_target_percent order per asset and rebalance, '
+                           'batch: apply the whole target weight vector at once (default: backtrader)')
+    parser.add_argument('--commission', type=float, default=0.0,
+                      metavar='FRACTION',
+                      help='Commission as a fraction of the traded value (default: 0)')
+    parser.add_argument('--slippage', type=float, default=0.0,
+                      metavar='FRACTION',
+                      help='Slippage as a fraction of the fill price, --broker batch only (default: 0)')
+    parser.add_argument('--analyzers', type=analyzer_list, default=[],
+                      metavar='NAME[,NAME...]',
+                      help=f'backtrader analyzers to attach and write as extra columns, '
+                           f'from {",".join(ANALYZER_NAMES)} (default: none)')
+    parser.add_argument('--log-level', choices=['DEBUG', 'INFO', 'WARNING'], default='DEBUG',
+                      help='DEBUG shows every rebalance, INFO only per-run summaries, '
+                           'WARNING neither (default: DEBUG)')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                      help='Same as --log-level WARNING, for large sweeps')
+    parser.add_argument('--profile', action='store_true',
+                      help='Time every stage, and for backtrader every run (feed loading, next, rebalance, '
+                           'broker, stop), count bars and orders, and print a summary at the end')
+    parser.add_argument('--profile-output', metavar='FILENAME',
+                      help='With --profile, also write the timings of every entry date to FILENAME as JSON')
+    parser.add_argument('--pstats', metavar='FILENAME',
+                      help='Run under cProfile and write pstats output to FILENAME '
+                           '(main process only, so combine with --jobs 1)')
+    parser.add_argument('--incremental', action='store_true',
+                      help='Only compute entry dates missing from the output file and merge them in, '
+                           'reusing rows computed with the same end date, coins, rebalance period and input files; '
+                           'the output is checkpointed every %d rows, so an interrupted run continues where it stopped'
+                           % WRITE_BATCH)
+
+def check_analyze(parser, args):
+    # Validate date ordering
+    if args.start_interval and args.start_interval[0] > args.start_interval[1]:
+        parser.error("Start date must be before end date")
+    if args.end_dates:
+        args.end_dates = sorted({end_date for dates in args.end_dates for end_date in dates})
+    end_dates = args.end_dates or [args.end_date]
+    if args.start_interval[1] >= end_dates[0]:
+        parser.error(f"start-interval end date ({args.start_interval[1]}) must be before every end date ({end_dates[0]})")
+    if len(set(args.cryptos)) < len(args.cryptos):
+        parser.error("--cryptos must not repeat a cryptocurrency")
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if args.rebalance_days < 1:
+        parser.error("--rebalance-days must be at least 1")
+    if not 0 <= args.min_allocation < 1:
+        parser.error("--min-allocation must be between 0 and 1")
+    if args.top is not None and args.top < 1:
+        parser.error("--top must be at least 1")
+    if args.analyzers and args.engine != 'backtrader':
+        parser.error("--analyzers requires --engine backtrader")
+    if args.end_dates and (args.analyzers or args.incremental):
+        parser.error("--end-dates cannot be combined with --analyzers or --incremental")
+    if args.engine != 'backtrader' and (args.broker != 'backtrader' or args.commission or args.slippage):
+        parser.error("--broker, --commission and --slippage require --engine backtrader")
+    if args.slippage and args.broker != 'batch':
+        parser.error("--slippage requires --broker batch")
+    if args.commission < 0 or args.slippage < 0:
+        parser.error("--commission and --slippage must not be negative")
+    if args.profile_output and not args.profile:
+        parser.error("--profile-output requires --profile")
+
+def analyze_command(parser, args, returns=None):
+    from analyze import (ANALYZERS, RunProfile, clear_cached_rows, format_horizon_rows, format_result, print_profile,
+                         read_cached_rows, results_key, run_backtests, run_horizons, write_cached_rows, write_profile)
+    from market_data import load_market_data
+
+    # Only configure analyze's own logger, so other libraries keep logging at the root WARNING level
+    logger = logging.getLogger('analyze')
+    logger.setLevel('WARNING' if args.quiet else args.log_level)
+    if not logger.handlers:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+    logger.propagate = False
+
+    data_dir = Path('data/normalized')
+
+    # Verify data directory exists
+    if not data_dir.exists():
+        print(f"\nERROR: Normalized data directory '{data_dir}' not found")
+        print("Please run normalize_data.py first to create normalized data files")
+        exit(1)
+
+    if args.cryptos == ['all']:
+        args.cryptos = sorted(file.stem for file in data_dir.glob('*.csv'))
+    print(f"Analyzing cryptocurrencies: {args.cryptos}")
+    data_files = [(data_dir / name).with_suffix('.csv') for name in args.cryptos]
+
+    # Stage timings of --profile and cProfile of --pstats
+    profile = RunProfile() if args.profile else None
+    entry_profiles = [] if args.profile else None
+    stage = profile.stage if profile is not None else lambda name: nullcontext()
+    profiler = cProfile.Profile() if args.pstats else None
+    if profiler is not None:
+        profiler.enable()
+
+    # Parse every data file once and share it across all market entry dates
+    try:
+        with stage('load'):
+            market_data = load_market_data(data_files)
+    except Exception as e:
+        print(f"Failed to load market data: {str(e)}")
+        exit(1)
+    
+    # Generate dates between start and end of interval
+    dates = []
+    current_date = args.start_interval[0]
+    while current_date <= args.start_interval[1]:
+        dates.append(current_date)
+        current_date += timedelta(days=1)
+    
+    end_dates = args.end_dates or [args.end_date]
+    returns = None
+    if args.end_dates:
+        # One run per entry date up to the last end date, snapshotted at every end date
+        with stage('backtest'):
+            results = run_horizons(data_files, dates, end_dates, market_data, args.engine, args.jobs,
+                                   args.rebalance_days, args.min_allocation, profiles=entry_profiles,
+                                   broker=args.broker, commission=args.commission, slippage=args.slippage,
+                                   top=args.top)
+        clear_cached_rows(args.output)
+        with stage('write'), open(args.output, 'w') as f:
+            f.write("market_entry,market_exit,asset,return\n")
+            f.writelines(format_horizon_rows(results, end_dates))
+    else:
+        columns = ['index'] + args.cryptos + [ANALYZERS[name][1] for name in args.analyzers]
+        header = f"market_entry,{','.join(columns)}\n"
+
+        # Reuse rows already computed with the same inputs
+        rows = {}
+        if args.incremental:
+            key = results_key(data_files, args.end_date, args.rebalance_days, args.min_allocation, args.analyzers,
+                              args.broker, args.commission, args.slippage, args.top)
+            rows = read_cached_rows(args.output, key)
+            dates = [d for d in dates if d.isoformat() not in rows]
+            print(f"Reusing {len(rows)} rows from {args.output}, computing {len(dates)} entry dates")
+        else:
+            clear_cached_rows(args.output)
+
+        # Results come in date order: a full run streams them to a temporary file renamed when complete,
+        # an incremental one checkpoints the merged rows so an interrupted run can be continued
+        def write(entries):
+            with stage('write'):
+                if args.incremental:
+                    write_cached_rows(args.output, header, rows, key)
+                else:
+                    f.writelines(rows[entry] + "\n" for entry in entries)
+
+        # Run strategy for each missing date
+        with stage('backtest'), (nullcontext() if args.incremental else open(f"{args.output}.tmp", 'w')) as f:
+            if f is not None:
+                f.write(header)
+            results = run_backtests(data_files, dates, args.end_date, market_data, args.engine, args.jobs,
+                                    args.rebalance_days, args.min_allocation, analyzers=args.analyzers,
+                                    profiles=entry_profiles, broker=args.broker, commission=args.commission,
+                                    slippage=args.slippage, top=args.top)
+            pending = []
+            for result in results:
+                if result:
+                    entry = result['market_entry'].isoformat()
+                    rows[entry] = format_result(result, columns)
+                    pending.append(entry)
+                    if len(pending) == WRITE_BATCH:
+                        write(pending)
+                        pending = []
+            write(pending)
+        if not args.incremental:
+            os.replace(f"{args.output}.tmp", args.output)
+        returns = returns_matrix(columns, rows)
+
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(args.pstats)
+        print(f"\ncProfile statistics written to {args.pstats} (view with: python -m pstats {args.pstats})")
+    if profile is not None:
+        print_profile(profile, entry_profiles)
+        if args.profile_output:
+            write_profile(args.profile_output, profile, entry_profiles)
+            print(f"Per entry date timings written to {args.profile_output}")
+    return returns
+
+def add_quantify_arguments(parser):
+    parser.add_argument('--input', default="returns.csv", help='Path to the CSV file containing analysis data (default: returns.csv)')
+    parser.add_argument('--output', help='Path to the output Markdown file (if not specified, prints to stdout)')
+    parser.add_argument('--chunksize', type=int, default=100000, help='Number of rows read from the input at a time (default: 100000)')
+
+def quantify_command(parser, args, returns=None):
+    from quantify import compute_statistics, matrix_statistics, write_results
+
+    if returns is not None:
+        results, coin_probabilities = matrix_statistics(returns)
+    else:
+        results, coin_probabilities = compute_statistics(args.input, args.chunksize)
+    write_results(results, coin_probabilities, args.output)
+    return returns
+
+def add_plot_arguments(parser):
+    from visualize import MAX_ANNOTATIONS
+
+    parser.add_argument('--input', default="returns.csv", help='Path to the CSV file containing analysis data (default: returns.csv)')
+    parser.add_argument('--output', help='Path to save the output image (optional, show image if undefined)')
+    parser.add_argument('-a', '--annotate', action='store_true', help='Show numerical values in heatmap cells')
+    parser.add_argument('--raster', action='store_true',
+                        help='Fast mode for wide date ranges: draw the matrix as one image, averaging '
+                             'entry dates that would share an output pixel column')
+    parser.add_argument('--max-annotations', type=int, default=MAX_ANNOTATIONS, metavar='N',
+                        help=f'Skip annotations when there are more than N cells (default: {MAX_ANNOTATIONS})')
+
+def plot_command(parser, args, returns=None):
+    import pandas as pd
+    from visualize import plot_heatmap
+
+    if returns is not None:
+        index = pd.DatetimeIndex(pd.to_datetime(returns.dates), name='market_entry')
+        data = pd.DataFrame(returns.values, index=index, columns=returns.columns)
+    else:
+        try:
+            data = pd.read_csv(args.input, parse_dates=['market_entry'])
+        except FileNotFoundError:
+            print(f"Error: File '{args.input}' not found.", file=sys.stderr)
+            sys.exit(1)
+        except Exception as e:
+            print(f"Error reading CSV file: {e}", file=sys.stderr)
+            sys.exit(1)
+        data.set_index('market_entry', inplace=True)
+    plot_heatmap(data, args.annotate, args.output, args.raster, args.max_annotations)
+    return returns
+
+# name -> (description, add arguments, check parsed arguments, run)
+COMMANDS = {
+    'normalize': ('Normalize historical data by adding zero values for dates before first recorded data point.',
+                  add_normalize_arguments, None, normalize_command),
+    'analyze': ('Cryptocurrency analysis tool', add_analyze_arguments, check_analyze, analyze_command),
+    'quantify': ('Compare cryptocurrency returns against an index using using different statistics.',
+                 add_quantify_arguments, None, quantify_command),
+    'plot': ('Compare cryptocurrency returns against an index using a heatmap.',
+             add_plot_arguments, None, plot_command),
+}
+
+def command_parser(name, prog=None):
+    """Parser of one subcommand; prog defaults to the running script, as for the standalone scripts."""
+    description, add_arguments, _, _ = COMMANDS[name]
+    parser = argparse.ArgumentParser(prog=prog, description=description)
+    add_arguments(parser)
+    return parser
+
+def run_script(name, argv=None):
+    """Run one subcommand with its standalone script's command line (normalize_data.py, analyze.py, ...)."""
+    parser = command_parser(name)
+    args = parser.parse_args(argv)
+    check = COMMANDS[name][2]
+    if check is not None:
+        check(parser, args)
+    COMMANDS[name][3](parser, args)
+
+def split_chain(argv):
+    """Split argv at every --then into [command, arguments...] segments."""
+    segments = [[]]
+    for arg in argv:
+        if arg == CHAIN_SEPARATOR:
+            segments.append([])
+        else:
+            segments[-1].append(arg)
+    return segments
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    prog = Path(sys.argv[0]).name
+    parser = argparse.ArgumentParser(prog=prog, description='Normalize, analyze, quantify and plot index backtests.',
+                                     epilog=f'Chain commands in one process with {CHAIN_SEPARATOR}, e.g. '
+                                            f'"analyze --cryptos btc eth {CHAIN_SEPARATOR} quantify '
+                                            f'{CHAIN_SEPARATOR} plot --output heatmap"; quantify and plot then '
+                                            'use the returns of the preceding analyze.')
+    parser.add_argument('command', choices=list(COMMANDS), help='Subcommand, see COMMAND --help')
+    if not argv or argv[0] not in COMMANDS:
+        parser.parse_args(argv[:1] or ['--help'])
+
+    # Parse and check every command before running the first one
+    chain = []
+    for segment in split_chain(argv):
+        if not segment or segment[0] not in COMMANDS:
+            parser.error(f"{CHAIN_SEPARATOR} must be followed by one of: {', '.join(COMMANDS)}")
+        command_args = command_parser(segment[0], f"{prog} {segment[0]}")
+        args = command_args.parse_args(segment[1:])
+        check = COMMANDS[segment[0]][2]
+        if check is not None:
+            check(command_args, args)
+        chain.append((segment[0], command_args, args))
+
+    for i, (name, _, args) in enumerate(chain):
+        if name == 'analyze' and args.end_dates and any(later in ('quantify', 'plot') for later, _, _ in chain[i + 1:]):
+            parser.error(f"analyze --end-dates writes a long table that cannot be chained {CHAIN_SEPARATOR} quantify or plot")
+
+    returns = None
+    for name, command_args, args in chain:
+        returns = COMMANDS[name][3](command_args, args, returns)
+
+if __name__ == '__main__':
+    main()
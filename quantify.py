@@ -1,67 +1,77 @@
-import argparse
-import csv
-from statistics import mean
+from math import fsum
+import numpy as np
 
-parser = argparse.ArgumentParser(description='Compare cryptocurrency returns against an index using using different statistics.')
-parser.add_argument('--input', default="returns.csv", help='Path to the CSV file containing analysis data (default: returns.csv)')
-parser.add_argument('--output', help='Path to the output Markdown file (if not specified, prints to stdout)')
-args = parser.parse_args()
+def compute_statistics(input_file, chunksize=100000):
+    """Compute per-asset statistics of a returns CSV, reading it in chunks of rows.
 
-# Initialize data structures
-data = []
-headers = []
+    Returns (results, coin_probabilities) where results maps every asset (index
+    included) to its worst return with date, average return and probability of a
+    negative return, and coin_probabilities maps every coin to the probability
+    that its return is smaller than the index return, over the rows where both
+    have one. Assets without any return are left out.
+    """
+    import pandas as pd
 
-# Read the CSV file
-with open(args.input, 'r') as csvfile:
-    csvreader = csv.reader(csvfile)
-    headers = next(csvreader)  # Get header row
-    for row in csvreader:
-        data.append(row)
+    def chunks():
+        for chunk in pd.read_csv(input_file, dtype=str, keep_default_na=False, chunksize=chunksize):
+            # Non-numeric cells are skipped, like float() failures in a row-by-row reader
+            yield (list(chunk.columns), chunk[chunk.columns[0]].to_numpy(),
+                   chunk[chunk.columns[1:]].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float))
+    return accumulate_statistics(chunks())
 
-# Prepare results
-results = {}
+def matrix_statistics(returns):
+    """compute_statistics of a returns table already in memory (pipeline.Returns)."""
+    return accumulate_statistics([(['market_entry'] + returns.columns, np.array(returns.dates, dtype=object),
+                                   returns.values)])
 
-# Process each asset (skip the first column which is the date)
-for i in range(1, len(headers)):
-    asset = headers[i]
-    asset_data = []
-    
-    # Collect all returns for this asset
-    for row in data:
-        try:
-            return_val = float(row[i])
-            asset_data.append((row[0], return_val))  # (date, return)
-        except ValueError:
-            continue
-    
-    # (1) Find worst return with corresponding day
-    worst_return = min(asset_data, key=lambda x: x[1])
-    
-    # (2) Calculate average return
-    avg_return = mean([x[1] for x in asset_data])
-    
-    # (4) Calculate probability of negative return
-    negative_returns = sum(1 for x in asset_data if x[1] < 0)
-    prob_negative = negative_returns / len(asset_data)
-    
-    # Store results for this asset
-    results[asset] = {
-        'worst_return': worst_return,
-        'average_return': avg_return,
-        'prob_negative': prob_negative
-    }
+def accumulate_statistics(chunks):
+    """compute_statistics over (columns, entry dates, dates x assets returns with NaN for empty cells) chunks."""
+    totals = {}
+    headers = None
+
+    for columns, dates, returns in chunks:
+        # Skip analyzer columns (named analyzer.key) written by analyze.py --analyzers
+        kept = [i for i, column in enumerate(columns[1:]) if '.' not in column]
+        if headers is None:
+            headers = [columns[0]] + [columns[1:][i] for i in kept]
+            for asset in headers[1:]:
+                totals[asset] = {'count': 0, 'sums': [], 'negative': 0, 'worst': None,
+                                 'compared': 0, 'less_than_index': 0}
 
-# (3) Calculate probability that return of a single coin is smaller than index
-index_returns = [float(row[1]) for row in data]  # Index is the second column (after date)
-coin_probabilities = {}
+        returns = returns[:, kept]
+        valid = ~np.isnan(returns)
+        index_returns = returns[:, 0]
 
-for coin in headers[2:]:  # Skip date and index columns
-    coin_returns = [float(row[headers.index(coin)]) for row in data]
-    count = sum(1 for c, i in zip(coin_returns, index_returns) if c < i)
-    probability = count / len(index_returns)
-    coin_probabilities[coin] = probability
+        for i, asset in enumerate(headers[1:]):
+            values = returns[valid[:, i], i]
+            if not len(values):
+                continue
+            asset_totals = totals[asset]
+            asset_totals['count'] += len(values)
+            asset_totals['sums'].append(values.sum())
+            asset_totals['negative'] += int((values < 0).sum())
+            worst = np.argmin(values)
+            if asset_totals['worst'] is None or values[worst] < asset_totals['worst'][1]:
+                asset_totals['worst'] = (dates[valid[:, i]][worst], float(values[worst]))
+            if i > 0:
+                compared = valid[:, i] & valid[:, 0]
+                asset_totals['compared'] += int(compared.sum())
+                asset_totals['less_than_index'] += int((returns[compared, i] < index_returns[compared]).sum())
 
-def write_results(output_file):
+    results = {}
+    for asset, asset_totals in totals.items():
+        if not asset_totals['count']:
+            continue
+        results[asset] = {
+            'worst_return': asset_totals['worst'],
+            'average_return': fsum(asset_totals['sums']) / asset_totals['count'],
+            'prob_negative': asset_totals['negative'] / asset_totals['count']
+        }
+    coin_probabilities = {coin: totals[coin]['less_than_index'] / totals[coin]['compared']
+                          for coin in headers[2:] if totals[coin]['compared']}
+    return results, coin_probabilities
+
+def write_results(results, coin_probabilities, output_file):
     if output_file:
         # Write results to Markdown file
         with open(output_file, 'w') as md_file:
@@ -93,5 +103,6 @@ def write_results(output_file):
         for asset, res in results.items():
             print(f"{asset}: {res['prob_negative']:.2%}")
 
-write_results(args.output)
-
+if __name__ == '__main__':
+    from pipeline import run_script
+    run_script('quantify')
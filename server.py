@@ -0,0 +1,190 @@
+"""Long-running backtest service keeping the normalized data and aligned arrays in memory.
+
+Every normalized file is loaded once at startup. Aligned arrays (and the
+market-cap weights cached in them, see index_engine) are kept per coin set,
+so repeated what-if queries skip interpreter startup, imports and data
+loading and only run the backtest. Rows are cached per entry date too, so a
+query only simulates the entry dates earlier queries with the same settings
+did not. See client.py for the command line client.
+
+API (JSON over HTTP):
+  GET  /coins   {"coins": [...]}
+  POST /run     {"cryptos": [...], "start_interval": [START, END], "end_date": DATE,
+                 optional "engine", "rebalance_days", "min_allocation", "top"}
+                -> {"columns": ["market_entry", "index", ...], "rows": [{...}, ...]}
+  POST /reload  reload data/normalized, e.g. after normalize_data.py
+"""
+import argparse
+import json
+import logging
+from collections import OrderedDict
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pathlib import Path
+from time import perf_counter
+from analyze import run_backtests
+from index_engine import align_market_data
+from market_data import load_market_data
+from pipeline import valid_date
+
+logger = logging.getLogger('server')
+
+class BacktestService:
+    """Normalized data of every coin in data_dir, plus aligned arrays and rows of the last cache_size queries.
+
+    Aligned arrays are kept per coin set, rows per coin set and backtest settings.
+    """
+
+    def __init__(self, data_dir, cache_size=32):
+        self.data_dir = Path(data_dir)
+        self.cache_size = cache_size
+        self.reload()
+
+    def reload(self):
+        self.data_files = {file.stem: file for file in sorted(self.data_dir.glob('*.csv'))}
+        self.market_data = load_market_data(list(self.data_files.values()))
+        self.aligned = OrderedDict()
+        self.rows = OrderedDict()
+
+    def cached(self, cache, key, make):
+        """cache[key], made with make() on first use and kept while among the cache_size most recent."""
+        if key in cache:
+            cache.move_to_end(key)
+        else:
+            cache[key] = make()
+            if len(cache) > self.cache_size:
+                cache.popitem(last=False)
+        return cache[key]
+
+    def aligned_for(self, names):
+        """Aligned arrays of a coin set."""
+        return self.cached(self.aligned, tuple(names), lambda: align_market_data(self.market_data, names))
+
+    def run(self, request):
+        """Backtest a /run request and return its columns and rows (values rounded like returns.csv)."""
+        if not isinstance(request, dict):
+            raise ValueError("request body must be a JSON object")
+        names = request.get('cryptos')
+        if not names or not isinstance(names, list):
+            raise ValueError("cryptos must be a non-empty list")
+        if len(set(names)) < len(names):
+            raise ValueError("cryptos must not repeat a coin")
+        if names == ['all']:
+            names = list(self.data_files)
+        missing = [name for name in names if name not in self.data_files]
+        if missing:
+            raise ValueError(f"unknown cryptos: {', '.join(missing)}")
+        start, end = (valid_date(value) for value in request['start_interval'])
+        end_date = valid_date(request['end_date'])
+        if start > end or end >= end_date:
+            raise ValueError("start_interval must be ordered and end before end_date")
+        engine = request.get('engine', 'numpy')
+        if engine not in ('numpy', 'backtrader'):
+            raise ValueError("engine must be numpy or backtrader")
+        rebalance_days = int(request.get('rebalance_days', 30))
+        min_allocation = float(request.get('min_allocation', 0.0))
+        top = request.get('top')
+        if rebalance_days < 1 or not 0 <= min_allocation < 1 or (top is not None and int(top) < 1):
+            raise ValueError("rebalance_days and top must be at least 1, min_allocation between 0 and 1")
+        top = top and int(top)
+
+        # Rows (None for entry dates without a result) of earlier queries with the same settings
+        settings = (tuple(names), end_date, engine, rebalance_days, min_allocation, top)
+        rows = self.cached(self.rows, settings, dict)
+        dates = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+        missing = [entry for entry in dates if entry not in rows]
+        columns = ['market_entry', 'index'] + names
+        if missing:
+            data_files = [self.data_files[name] for name in names]
+            results = run_backtests(data_files, missing, end_date, self.market_data, engine,
+                                    rebalance_days=rebalance_days, min_allocation=min_allocation,
+                                    aligned=self.aligned_for(names), top=top)
+            # Only cache once the whole run succeeded, so a failed query is recomputed on retry
+            new_rows = dict.fromkeys(missing)
+            for result in results:
+                if result:
+                    row = {'market_entry': result['market_entry'].isoformat()}
+                    # Round through the returns.csv format so clients can write identical files
+                    row.update((key, None if result.get(key) is None else float(f"{result[key]:.2f}"))
+                               for key in columns[1:])
+                    new_rows[result['market_entry']] = row
+            rows.update(new_rows)
+        return {'columns': columns, 'rows': [rows[entry] for entry in dates if rows[entry] is not None]}
+
+class RequestHandler(BaseHTTPRequestHandler):
+    service = None
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/coins':
+            self.send_json(200, {'coins': list(self.service.data_files)})
+        else:
+            self.send_json(404, {'error': f"unknown path {self.path}"})
+
+    def do_POST(self):
+        started = perf_counter()
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            if self.path == '/run':
+                body = self.service.run(request)
+            elif self.path == '/reload':
+                self.service.reload()
+                body = {'coins': list(self.service.data_files)}
+            else:
+                self.send_json(404, {'error': f"unknown path {self.path}"})
+                return
+        except (ValueError, KeyError, TypeError, argparse.ArgumentTypeError) as e:
+            self.send_json(400, {'error': str(e)})
+            return
+        except Exception as e:
+            logger.exception(f"{self.path} failed")
+            self.send_json(500, {'error': f"{type(e).__name__}: {e}"})
+            return
+        self.send_json(200, body)
+        logger.info(f"{self.path} {len(body.get('rows', []))} rows in {(perf_counter() - started) * 1000:.1f} ms")
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve index backtests over HTTP with the data kept in memory.')
+    parser.add_argument('--host', default='127.0.0.1',
+                      help='Address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8765,
+                      help='Port to listen on (default: 8765)')
+    parser.add_argument('--cache-size', type=int, default=32, metavar='N',
+                      help='Number of coin sets (aligned arrays) and of query settings (rows) kept in memory (default: 32)')
+    parser.add_argument('--log-level', choices=['DEBUG', 'INFO', 'WARNING'], default='INFO',
+                      help='INFO logs every request with its latency (default: INFO)')
+    args = parser.parse_args()
+
+    if args.cache_size < 1:
+        parser.error("--cache-size must be at least 1")
+    logging.basicConfig(format='%(message)s')
+    logger.setLevel(args.log_level)
+
+    data_dir = Path('data/normalized')
+    if not data_dir.exists():
+        print(f"\nERROR: Normalized data directory '{data_dir}' not found")
+        print("Please run normalize_data.py first to create normalized data files")
+        exit(1)
+
+    RequestHandler.service = BacktestService(data_dir, args.cache_size)
+    server = HTTPServer((args.host, args.port), RequestHandler)
+    print(f"Serving {len(RequestHandler.service.data_files)} coins on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
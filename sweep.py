@@ -0,0 +1,108 @@
+import argparse
+from datetime import timedelta
+from pathlib import Path
+from analyze import run_horizons
+from index_engine import align_market_data
+from market_data import load_market_data
+from pipeline import valid_date
+
+def sweep(data_files, dates, end_dates, rebalance_days_grid, min_allocation_grid, output_file,
+          engine='numpy', jobs=1):
+    """Backtest every grid point and write one (parameters, entry, asset, return) row per result.
+
+    Market data is loaded and aligned once; market-cap weights are computed once
+    per minimum allocation and shared by every rebalance period. Each entry date
+    is simulated once per rebalance period and minimum allocation, and its
+    returns are snapshotted at every end date.
+    """
+    market_data = load_market_data(data_files)
+    aligned = align_market_data(market_data, [file.stem for file in data_files])
+
+    output_file.write("rebalance_days,min_allocation,end_date,market_entry,asset,return\n")
+    for rebalance_days in rebalance_days_grid:
+        for min_allocation in min_allocation_grid:
+            print(f"Running rebalance every {rebalance_days} days, min allocation {min_allocation}")
+            results = run_horizons(data_files, dates, end_dates, market_data, engine, jobs,
+                                   rebalance_days, min_allocation, aligned)
+            for end_date in end_dates:
+                prefix = f"{rebalance_days},{min_allocation},{end_date.isoformat()}"
+                lines = []
+                for result in results[end_date]:
+                    entry = result['market_entry'].isoformat()
+                    for asset, value in result.items():
+                        if asset != 'market_entry':
+                            lines.append(f"{prefix},{entry},{asset},{value:.2f}\n")
+                output_file.writelines(lines)
+
+def main():
+    DEFAULT_START_INTERVAL0 = valid_date("2018-01-01")
+    DEFAULT_START_INTERVAL1 = valid_date("2018-12-31")
+    DEFAULT_END = valid_date("2024-12-31")
+    DEFAULT_OUTPUT = "sweep.csv"
+
+    parser = argparse.ArgumentParser(description='Sweep index backtests over a grid of rebalance periods, minimum allocations and end dates.')
+    parser.add_argument('--cryptos', nargs='+', default=['bitcoin', 'ethereum', 'cardano'],
+                       help='List of cryptocurrencies to analyze (space-separated)')
+    parser.add_argument('--start-interval', nargs=2, type=valid_date,
+                   default=[DEFAULT_START_INTERVAL0, DEFAULT_START_INTERVAL1],
+                   metavar=('START', 'END'),
+                   help=f'Date range of market entries (default: {DEFAULT_START_INTERVAL0} to {DEFAULT_START_INTERVAL1})')
+    parser.add_argument('--end-dates', nargs='+', type=valid_date,
+                      default=[DEFAULT_END],
+                      metavar='DATE',
+                      help=f'End dates to sweep (default: {DEFAULT_END})')
+    parser.add_argument('--rebalance-days', nargs='+', type=int, default=[30],
+                      metavar='DAYS',
+                      help='Rebalance periods to sweep, in days (default: 30)')
+    parser.add_argument('--min-allocation', nargs='+', type=float, default=[0.0],
+                      metavar='FRACTION',
+                      help='Minimum allocation thresholds to sweep (default: 0)')
+    parser.add_argument('--engine', choices=['backtrader', 'numpy'], default='numpy',
+                      help='Backtest engine (default: numpy)')
+    parser.add_argument('--jobs', type=int, default=1,
+                      metavar='N',
+                      help='Number of worker processes for the backtrader engine (default: 1)')
+    parser.add_argument('--output', type=str,
+                      default=DEFAULT_OUTPUT,
+                      metavar='FILENAME',
+                      help=f'Output filename (default: {DEFAULT_OUTPUT})')
+    args = parser.parse_args()
+
+    # Validate parameters, sweeping every grid value once
+    args.end_dates = sorted(set(args.end_dates))
+    args.rebalance_days = list(dict.fromkeys(args.rebalance_days))
+    args.min_allocation = list(dict.fromkeys(args.min_allocation))
+    if len(set(args.cryptos)) < len(args.cryptos):
+        parser.error("--cryptos must not repeat a cryptocurrency")
+    if args.start_interval[0] > args.start_interval[1]:
+        parser.error("Start date must be before end date")
+    for end_date in args.end_dates:
+        if args.start_interval[1] >= end_date:
+            parser.error(f"start-interval end date ({args.start_interval[1]}) must be before every end date ({end_date})")
+    if any(days < 1 for days in args.rebalance_days):
+        parser.error("--rebalance-days must be at least 1")
+    if any(not 0 <= fraction < 1 for fraction in args.min_allocation):
+        parser.error("--min-allocation must be between 0 and 1")
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+
+    data_dir = Path('data/normalized')
+    data_files = [(data_dir / name).with_suffix('.csv') for name in args.cryptos]
+
+    # Generate dates between start and end of interval
+    dates = []
+    current_date = args.start_interval[0]
+    while current_date <= args.start_interval[1]:
+        dates.append(current_date)
+        current_date += timedelta(days=1)
+
+    try:
+        with open(args.output, 'w') as f:
+            sweep(data_files, dates, args.end_dates, args.rebalance_days, args.min_allocation, f,
+                  args.engine, args.jobs)
+    except FileNotFoundError as e:
+        print(f"Failed to load market data: {str(e)}")
+        exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""Parity of the NumPy index engine and the batch broker with backtrader on the shipped data/normalized files.
+
+index_engine and BatchRebalanceBroker reimplement BackBroker's order sizing,
+margin checks and fills, so they must produce the same returns.csv rows.
+Run with pytest.
+"""
+from datetime import date
+from pathlib import Path
+import pytest
+from analyze import format_result, run_backtests
+from market_data import load_market_data
+
+DATA_DIR = Path(__file__).parent / 'data' / 'normalized'
+DEMO_CRYPTOS = ['btc', 'eth', 'bch', 'xrp', 'ltc', 'ada', 'iota', 'dash', 'xem', 'xmr']
+# sol, sui and avax list years after btc and eth
+LATE_LISTED_CRYPTOS = ['btc', 'sol', 'sui', 'avax', 'eth']
+
+def backtest_rows(cryptos, dates, end_date, engine, **settings):
+    data_files = [DATA_DIR / f"{name}.csv" for name in cryptos]
+    market_data = load_market_data(data_files)
+    results = run_backtests(data_files, dates, end_date, market_data, engine, **settings)
+    return [result and format_result(result) for result in results]
+
+@pytest.mark.parametrize('cryptos, dates, end_date, settings', [
+    (DEMO_CRYPTOS, [date(2017, 12, 1), date(2018, 1, 15), date(2018, 3, 31)], date(2024, 12, 31), {}),
+    (DEMO_CRYPTOS, [date(2018, 1, 1), date(2018, 6, 30)], date(2024, 12, 31), {'min_allocation': 0.05}),
+    (DEMO_CRYPTOS, [date(2018, 1, 1), date(2018, 6, 30)], date(2024, 12, 31), {'top': 3}),
+    (LATE_LISTED_CRYPTOS, [date(2019, 1, 1), date(2021, 6, 1), date(2023, 6, 1)], date(2024, 12, 31), {}),
+    (LATE_LISTED_CRYPTOS, [date(2021, 6, 1), date(2023, 6, 1)], date(2024, 12, 31),
+     {'min_allocation': 0.02, 'rebalance_days': 7}),
+    (LATE_LISTED_CRYPTOS, [date(2021, 6, 1), date(2023, 6, 1)], date(2024, 12, 31), {'top': 2}),
+])
+def test_numpy_engine_matches_backtrader(cryptos, dates, end_date, settings):
+    expected = backtest_rows(cryptos, dates, end_date, 'backtrader', **settings)
+    assert any(expected)
+    assert backtest_rows(cryptos, dates, end_date, 'numpy', **settings) == expected
+
+@pytest.mark.parametrize('cryptos, dates, end_date, settings', [
+    (DEMO_CRYPTOS, [date(2017, 12, 1), date(2018, 3, 31)], date(2024, 12, 31), {}),
+    (DEMO_CRYPTOS, [date(2018, 1, 1), date(2018, 6, 30)], date(2024, 12, 31), {'commission': 0.001}),
+    (DEMO_CRYPTOS, [date(2018, 1, 1)], date(2024, 12, 31), {'commission': 0.01, 'min_allocation': 0.05}),
+    (LATE_LISTED_CRYPTOS, [date(2021, 6, 1), date(2023, 6, 1)], date(2024, 12, 31), {'top': 2}),
+    (LATE_LISTED_CRYPTOS, [date(2019, 1, 1), date(2021, 6, 1)], date(2024, 12, 31),
+     {'commission': 0.005, 'top': 3, 'rebalance_days': 7}),
+])
+def test_batch_broker_matches_backtrader(cryptos, dates, end_date, settings):
+    expected = backtest_rows(cryptos, dates, end_date, 'backtrader', **settings)
+    assert any(expected)
+    assert backtest_rows(cryptos, dates, end_date, 'backtrader', broker='batch', **settings) == expected
@@ -1,28 +1,52 @@
-import argparse
-import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
 import sys
-from matplotlib.colors import LinearSegmentedColormap
-
-def main():
-    # Argument parsing (unchanged)
-    parser = argparse.ArgumentParser(description='Compare cryptocurrency returns against an index using a heatmap.')
-    parser.add_argument('--input', default="returns.csv", help='Path to the CSV file containing analysis data (default: returns.csv)')
-    parser.add_argument('--output', help='Path to save the output image (optional, show image if undefined)')
-    parser.add_argument('-a', '--annotate', action='store_true', help='Show numerical values in heatmap cells')
-    args = parser.parse_args()
-
-    try:
-        data = pd.read_csv(args.input, parse_dates=['market_entry'])
-    except FileNotFoundError:
-        print(f"Error: File '{args.input}' not found.", file=sys.stderr)
-        sys.exit(1)
-    except Exception as e:
-        print(f"Error reading CSV file: {e}", file=sys.stderr)
-        sys.exit(1)
-
-    data.set_index('market_entry', inplace=True)
+import numpy as np
+
+SAVE_DPI = 300
+# Text per cell is what makes big annotated plots slow; above this many cells annotations are skipped
+MAX_ANNOTATIONS = 5000
+
+def bin_columns(matrix, width):
+    """Average groups of adjacent columns so at most width remain; returns (binned matrix, columns per bin)."""
+    size = -(-matrix.shape[1] // width) if matrix.shape[1] > width else 1
+    if size == 1:
+        return matrix, 1
+    n_bins = -(-matrix.shape[1] // size)
+    padded = np.full((matrix.shape[0], n_bins * size), np.nan)
+    padded[:, :matrix.shape[1]] = matrix
+    with np.errstate(invalid='ignore'):
+        counts = (~np.isnan(padded)).reshape(matrix.shape[0], n_bins, size).sum(axis=2)
+        sums = np.nansum(padded.reshape(matrix.shape[0], n_bins, size), axis=2)
+        return np.where(counts > 0, sums / np.maximum(counts, 1), np.nan), size
+
+def draw_raster(ax, comparison, cmap, vmin, vmax, annotate, font_size):
+    """Draw coins x dates as a single image on ax in heatmap coordinates (one unit per date and coin)."""
+    matrix = comparison.T.to_numpy(dtype=float)
+    # One image column per output pixel column at most
+    width = int(ax.get_position().width * ax.figure.get_figwidth() * SAVE_DPI)
+    binned, size = bin_columns(matrix, max(width, 1))
+    image = ax.imshow(binned, cmap=cmap, vmin=vmin, vmax=vmax, aspect='auto', interpolation='nearest',
+                      extent=(0, binned.shape[1] * size, matrix.shape[0], 0))
+    ax.set_xlim(0, matrix.shape[1])
+    ax.set_yticks([y + 0.5 for y in range(matrix.shape[0])])
+    ax.set_yticklabels(comparison.columns)
+    if annotate:
+        for (row, column), value in np.ndenumerate(binned):
+            if not np.isnan(value):
+                ax.text((column + 0.5) * size, row + 0.5, f"{value:.1f}", ha='center', va='center',
+                        fontsize=font_size * 0.6)
+    return ax.figure.colorbar(image, ax=ax)
+
+def plot_heatmap(data, annotate=False, output=None, raster=False, max_annotations=MAX_ANNOTATIONS):
+    """Plot coin minus index returns of data (indexed by market_entry) and save it to output or show it.
+
+    raster draws the matrix as one image, averaging entry dates down to the
+    output pixel width, which keeps very wide date ranges fast.
+    """
+    import matplotlib.pyplot as plt
+    from matplotlib.colors import LinearSegmentedColormap
+
+    # Skip analyzer columns (named analyzer.key) written by analyze.py --analyzers
+    data = data[[column for column in data.columns if '.' not in column]]
     comparison = data.drop(columns=['index']).subtract(data['index'], axis=0)
 
     # Visualization setup
@@ -36,13 +60,36 @@ def main():
     fig_height = (FONT_SIZE * CELL_HEIGHT_RATIO * n_cryptos) / 72
 
     fig, ax = plt.subplots(figsize=(16, fig_height))
-    
+
+    if annotate and comparison.size > max_annotations:
+        print(f"Skipping annotations: {comparison.size} cells is more than --max-annotations {max_annotations}",
+              file=sys.stderr)
+        annotate = False
+
+    if raster:
+        cbar = draw_raster(ax, comparison, cmap, vmin, vmax, annotate, FONT_SIZE)
+    else:
+        cbar = draw_heatmap(ax, comparison, cmap, vmin, vmax, annotate)
+    set_labels(ax, cbar, comparison, FONT_SIZE)
+
+    plt.tight_layout()
+    if output:
+        output_path = output if output.endswith('.png') else f"{output}.png"
+        plt.savefig(output_path, dpi=SAVE_DPI, bbox_inches='tight')
+        plt.close()
+    else:
+        plt.show()
+
+def draw_heatmap(ax, comparison, cmap, vmin, vmax, annotate):
+    """Draw coins x dates as a seaborn heatmap with one outlined cell per value."""
+    import seaborn as sns
+
     # Create heatmap and pass the ax explicitly
     heatmap = sns.heatmap(
         comparison.T,
         cmap=cmap,
         center=0,
-        annot=args.annotate,
+        annot=annotate,
         fmt=".1f",
         linewidths=0.5,
         linecolor='face',
@@ -53,7 +100,10 @@ def main():
         yticklabels=True,
         ax=ax  # Use our pre-created axes
     )
+    return heatmap.collections[0].colorbar
 
+def set_labels(ax, cbar, comparison, font_size):
+    """Date ticks, coin labels, titles and colorbar fonts shared by both drawing modes."""
     # Set custom x-axis labels
     num_dates = len(comparison.index)
     step = max(1, num_dates // 20)
@@ -61,29 +111,21 @@ def main():
     xticks_labels = [comparison.index[i].strftime('%Y-%m-%d') for i in xticks_pos]
     
     ax.set_xticks([x + 0.5 for x in xticks_pos])  # Add 0.5 to center labels
-    ax.set_xticklabels(xticks_labels, rotation=45, ha='right', fontsize=FONT_SIZE)
+    ax.set_xticklabels(xticks_labels, rotation=45, ha='right', fontsize=font_size)
     
     # Y-axis settings
-    ax.set_yticklabels(ax.get_yticklabels(), rotation=0, fontsize=FONT_SIZE)
+    ax.set_yticklabels(ax.get_yticklabels(), rotation=0, fontsize=font_size)
     
-    # ax.set_title(f'Cryptocurrency Returns vs Index, %', fontsize=FONT_SIZE+2)
-    ax.set_title(f'Разница в возврате крипто-индекс, %', fontsize=FONT_SIZE+2)
-    # ax.set_xlabel('Market Entry Date', fontsize=FONT_SIZE)
-    ax.set_xlabel('Дата входа на рынок', fontsize=FONT_SIZE+2)
-    # ax.set_ylabel('Cryptocurrency', fontsize=FONT_SIZE)
+    # ax.set_title(f'Cryptocurrency Returns vs Index, %', fontsize=font_size+2)
+    ax.set_title(f'Разница в возврате крипто-индекс, %', fontsize=font_size+2)
+    # ax.set_xlabel('Market Entry Date', fontsize=font_size)
+    ax.set_xlabel('Дата входа на рынок', fontsize=font_size+2)
+    # ax.set_ylabel('Cryptocurrency', fontsize=font_size)
 
     # Colorbar settings
-    cbar = heatmap.collections[0].colorbar
-    cbar.ax.tick_params(labelsize=FONT_SIZE)
-    cbar.ax.yaxis.label.set_size(FONT_SIZE)
-
-    plt.tight_layout()
-    if args.output:
-        output_path = args.output if args.output.endswith('.png') else f"{args.output}.png"
-        plt.savefig(output_path, dpi=300, bbox_inches='tight')
-        plt.close()
-    else:
-        plt.show()
+    cbar.ax.tick_params(labelsize=font_size)
+    cbar.ax.yaxis.label.set_size(font_size)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    from pipeline import run_script
+    run_script('plot')
\ No newline at end of file